@@ -0,0 +1,66 @@
+import re
+import unicodedata
+
+# one typo is tolerated for every this many characters of the answer
+CHARACTERS_PER_TYPO = 5
+
+ARTICLES = ('the', 'a', 'an')
+
+"""
+normalize_answer(text)
+    the words of an answer, without case, accents, punctuation and
+    leading article, joined by single spaces
+"""
+
+
+def normalize_answer(text):
+    text = unicodedata.normalize('NFKD', text or '')
+    text = ''.join(char for char in text
+                   if not unicodedata.combining(char)).casefold()
+    words = re.sub(r'[\W_]+', ' ', text).split()
+    if len(words) > 1 and words[0] in ARTICLES:
+        words = words[1:]
+    return ' '.join(words)
+
+
+"""
+edit_distance(first, second, limit)
+    the Levenshtein distance between two strings, computed row by row
+    and given up as limit + 1 once it can only exceed limit
+"""
+
+
+def edit_distance(first, second, limit):
+    if abs(len(first) - len(second)) > limit:
+        return limit + 1
+    previous = list(range(len(second) + 1))
+    for i, first_char in enumerate(first, 1):
+        current = [i]
+        for j, second_char in enumerate(second, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1,
+                               previous[j - 1] + (first_char != second_char)))
+        if min(current) > limit:
+            return limit + 1
+        previous = current
+    return previous[-1]
+
+
+"""
+answers_match(given, expected)
+    tells whether an answer matches the expected one once both are
+    normalized, allowing a typo every CHARACTERS_PER_TYPO characters.
+    numbers must match exactly, as 1990 is not a typo of 1991
+"""
+
+
+def answers_match(given, expected):
+    given = normalize_answer(given)
+    expected = normalize_answer(expected)
+    if not given:
+        return False
+    if given == expected:
+        return True
+    if re.findall(r'\d+', given) != re.findall(r'\d+', expected):
+        return False
+    limit = len(expected) // CHARACTERS_PER_TYPO
+    return edit_distance(given, expected, limit) <= limit
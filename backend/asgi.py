@@ -0,0 +1,173 @@
+"""
+ASGI entry point for the trivia API
+
+Serves the routes of create_app from an ASGI server such as uvicorn:
+
+    uvicorn --factory asgi:create_asgi_app --workers 2
+
+The event loop of each worker holds the client connections, idle and
+keep-alive ones included, while requests run on a pool of threads, so a
+worker is no longer tied up by a slow client. The database calls stay
+synchronous: the pool has ASGI_THREADS threads, by default as many as the
+database connections a worker may open, so requests beyond that wait
+for a thread instead of waiting for a connection while holding one.
+"""
+import asyncio
+import os
+import sys
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+from flaskr import create_app
+
+ASGI_THREADS = int(os.getenv('ASGI_THREADS', 0))
+
+# request bodies larger than this are spooled to a temporary file
+MAX_MEMORY_BODY = 1024 * 1024
+
+
+"""
+WsgiToAsgi
+    runs a WSGI application on a thread pool behind the ASGI interface.
+    the request body is read before the application is called, and the
+    response is sent as the application produces it, so streamed
+    responses stay streamed
+"""
+
+
+class WsgiToAsgi:
+
+    def __init__(self, wsgi_app, threads):
+        self.wsgi_app = wsgi_app
+        self.executor = ThreadPoolExecutor(
+            threads, thread_name_prefix='asgi')
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'http':
+            await self.handle_http(scope, receive, send)
+        elif scope['type'] == 'lifespan':
+            await self.handle_lifespan(receive, send)
+        else:
+            raise ValueError('Unsupported scope type ' + scope['type'])
+
+    async def handle_lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self.executor.shutdown(wait=True)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def handle_http(self, scope, receive, send):
+        body = tempfile.SpooledTemporaryFile(max_size=MAX_MEMORY_BODY)
+        more_body = True
+        while more_body:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                return
+            body.write(message.get('body', b''))
+            more_body = message.get('more_body', False)
+        length = body.tell()
+        body.seek(0)
+
+        loop = asyncio.get_running_loop()
+
+        def send_from_thread(message):
+            asyncio.run_coroutine_threadsafe(send(message), loop).result()
+
+        try:
+            await loop.run_in_executor(
+                self.executor, self.run_wsgi,
+                wsgi_environ(scope, body, length), send_from_thread)
+        finally:
+            body.close()
+
+    def run_wsgi(self, environ, send):
+        started = []
+        response_start = []
+
+        def start_response(status, headers, exc_info=None):
+            if exc_info is not None and started:
+                raise exc_info[1].with_traceback(exc_info[2])
+            response_start[:] = [{
+                'type': 'http.response.start',
+                'status': int(status.split(' ', 1)[0]),
+                'headers': [(name.lower().encode('latin-1'),
+                             value.encode('latin-1'))
+                            for name, value in headers],
+            }]
+            return write
+
+        def write(chunk):
+            if not started:
+                send(response_start[0])
+                started.append(True)
+            if chunk:
+                send({'type': 'http.response.body', 'body': chunk,
+                      'more_body': True})
+
+        result = self.wsgi_app(environ, start_response)
+        try:
+            for chunk in result:
+                write(chunk)
+            if not started:
+                send(response_start[0])
+            send({'type': 'http.response.body', 'body': b''})
+        finally:
+            if hasattr(result, 'close'):
+                result.close()
+
+
+"""
+wsgi_environ(scope, body, length)
+    the WSGI environ of an ASGI http scope whose body has been read, length
+    bytes of it. the input is marked terminated and its length given as
+    CONTENT_LENGTH even when the client sent none, as with a chunked body,
+    which WSGI apps would otherwise read as empty
+"""
+
+
+def wsgi_environ(scope, body, length):
+    server = scope.get('server') or ('localhost', 80)
+    client = scope.get('client') or ('', 0)
+    root_path = scope.get('root_path', '')
+    path = scope['path']
+    if root_path and path.startswith(root_path):
+        path = path[len(root_path):]
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': root_path.encode().decode('latin-1'),
+        'PATH_INFO': path.encode().decode('latin-1'),
+        'QUERY_STRING': scope['query_string'].decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': 'HTTP/' + scope.get('http_version', '1.1'),
+        'REMOTE_ADDR': client[0],
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': body,
+        'wsgi.input_terminated': True,
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    for name, value in scope['headers']:
+        name = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        if name not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+            name = 'HTTP_' + name
+        if name in environ:
+            value = environ[name] + ',' + value
+        environ[name] = value
+    environ['CONTENT_LENGTH'] = str(length)
+    return environ
+
+
+def create_asgi_app(test_config=None):
+    app = create_app(test_config)
+    threads = ASGI_THREADS or (
+        app.config['DB_POOL_SIZE'] + app.config['DB_MAX_OVERFLOW'])
+    return WsgiToAsgi(app, threads)
@@ -0,0 +1,364 @@
+"""
+Latency benchmark for the trivia API
+
+Seeds a dedicated database with synthetic questions, then drives every
+route with concurrent clients and reports p50/p95/p99 latency, throughput
+and database queries per request, for each table size:
+
+    python benchmark.py \\
+        --database-url postgresql://postgres@localhost/trivia_bench \\
+        --sizes 1000,100000,1000000 --requests 500 --concurrency 8
+
+THE TABLES OF THE BENCHMARK DATABASE ARE DROPPED AND RE-CREATED, never
+point it at a database holding data you want to keep.
+
+Requests go through the Flask test client by default, through HTTP to a
+local threaded WSGI server with --server, or through HTTP to a local
+uvicorn server running the ASGI entry point with --asgi, to compare the
+concurrent throughput of both serving modes:
+
+    python benchmark.py --server --concurrency 64 --save wsgi.json
+    python benchmark.py --asgi --concurrency 64 --compare wsgi.json
+
+Results can be saved with --save
+and compared against a saved baseline with --compare, in which case the
+exit status is 1 when the p95 latency of a route regressed by more than
+--threshold.
+"""
+import argparse
+import json
+import math
+import os
+import random
+import socket
+import sys
+import tempfile
+import threading
+import time
+from http.client import HTTPConnection
+
+from sqlalchemy import event
+from werkzeug.serving import make_server, WSGIRequestHandler
+
+from asgi import create_asgi_app
+from flaskr import create_app, QUESTIONS_PER_PAGE
+from models import db
+from seeding import seed_database, WORDS
+
+CATEGORY_NAMES = ('Science', 'Art', 'Geography',
+                  'History', 'Entertainment', 'Sports')
+
+
+"""
+QueryCounter
+    counts the statements executed by an engine
+"""
+
+
+class QueryCounter:
+
+    def __init__(self, engine):
+        self.count = 0
+        self._lock = threading.Lock()
+        event.listen(engine, 'before_cursor_execute', self._count)
+
+    def _count(self, *args):
+        with self._lock:
+            self.count += 1
+
+
+"""
+seed(size, category_skew, id_gap)
+    replaces the content of the benchmark database with the six usual
+    categories and size synthetic questions from flask seed, spread over
+    the categories as category_skew says, with sparse ids when id_gap
+    is set
+"""
+
+
+def seed(size, category_skew=0.0, id_gap=0):
+    db.drop_all()
+    db.create_all()
+    return seed_database(len(CATEGORY_NAMES), size, category_skew,
+                         id_gap=id_gap, seed=size,
+                         category_names=CATEGORY_NAMES)
+
+
+"""
+Clients: both send a request and return its status code
+"""
+
+
+class TestClient:
+
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def request(self, method, path, body=None):
+        return self.client.open(path, method=method, json=body).status_code
+
+
+class HTTPClient:
+
+    def __init__(self, port):
+        self.connection = HTTPConnection('127.0.0.1', port)
+
+    def request(self, method, path, body=None):
+        headers = {}
+        if body is not None:
+            body = json.dumps(body)
+            headers['Content-Type'] = 'application/json'
+        self.connection.request(method, path, body, headers)
+        response = self.connection.getresponse()
+        response.read()
+        return response.status
+
+
+class QuietRequestHandler(WSGIRequestHandler):
+
+    def log_request(self, *args, **kwargs):
+        pass
+
+
+"""
+Scenarios: each returns the (method, path, body) of a request,
+drawn at random for the seeded table size
+"""
+
+
+def scenarios(size, category_ids):
+    pages = max(math.ceil(size / QUESTIONS_PER_PAGE), 1)
+
+    def quiz_request(rng):
+        category_id = rng.choice(category_ids + [0])
+        previous = [rng.randint(1, size) for _ in range(rng.randint(0, 4))]
+        return 'POST', '/quizzes', {
+            'quiz_category': category_id, 'previous_questions': previous}
+
+    return {
+        'get_categories':
+            lambda rng: ('GET', '/categories', None),
+        'get_questions':
+            lambda rng: ('GET', '/questions?page={}'.format(
+                rng.randint(1, pages)), None),
+        'get_questions_by_category':
+            lambda rng: ('GET', '/categories/{}/questions'.format(
+                rng.choice(category_ids)), None),
+        'search_questions':
+            lambda rng: ('POST', '/questions/search', {
+                'searchTerm': rng.choice(WORDS)}),
+        'get_quiz_play': quiz_request,
+    }
+
+
+"""
+start_asgi_server(app)
+    serves an ASGI app with uvicorn from a background thread and
+    returns the server and its port
+"""
+
+
+def start_asgi_server(app):
+    import uvicorn
+
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        port = probe.getsockname()[1]
+    server = uvicorn.Server(uvicorn.Config(
+        app, host='127.0.0.1', port=port, log_level='warning',
+        access_log=False, lifespan='off'))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.01)
+    return server, port
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+
+"""
+run_scenario(make_client, scenario, requests, concurrency, counter)
+    sends requests requests built by scenario from concurrency threads,
+    each with its own client, and returns the measured statistics
+"""
+
+
+def run_scenario(make_client, scenario, requests, concurrency, counter):
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+
+    def worker(worker_number, worker_requests):
+        client = make_client()
+        rng = random.Random(worker_number)
+        measured = []
+        failed = 0
+        for _ in range(worker_requests):
+            method, path, body = scenario(rng)
+            started = time.perf_counter()
+            status = client.request(method, path, body)
+            measured.append(time.perf_counter() - started)
+            if status >= 500:
+                failed += 1
+        with lock:
+            latencies.extend(measured)
+            errors.append(failed)
+
+    shares = [requests // concurrency + (1 if n < requests % concurrency
+                                         else 0)
+              for n in range(concurrency)]
+    threads = [threading.Thread(target=worker, args=(n, share))
+               for n, share in enumerate(shares)]
+    queries_before = counter.count
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    return {
+        'requests': requests,
+        'errors': sum(errors),
+        'p50_ms': percentile(latencies, 0.50) * 1000,
+        'p95_ms': percentile(latencies, 0.95) * 1000,
+        'p99_ms': percentile(latencies, 0.99) * 1000,
+        'throughput': requests / elapsed if elapsed else 0.0,
+        'queries_per_request': (counter.count - queries_before) / requests,
+    }
+
+
+def print_results(size, results):
+    print('\n{} questions'.format(size))
+    print('{:<28}{:>10}{:>10}{:>10}{:>12}{:>10}{:>8}'.format(
+        'route', 'p50 ms', 'p95 ms', 'p99 ms', 'req/s', 'queries', 'errors'))
+    for route, stats in results.items():
+        row = '{:<28}{:>10.2f}{:>10.2f}{:>10.2f}{:>12.1f}{:>10.1f}{:>8}'
+        print(row.format(
+            route, stats['p50_ms'], stats['p95_ms'], stats['p99_ms'],
+            stats['throughput'], stats['queries_per_request'],
+            stats['errors']))
+
+
+"""
+find_regressions(results, baseline, threshold)
+    lists the routes whose p95 latency grew by more than threshold
+    (a fraction) compared to the baseline results
+"""
+
+
+def find_regressions(results, baseline, threshold):
+    regressions = []
+    for size, routes in results.items():
+        for route, stats in routes.items():
+            before = baseline.get(size, {}).get(route)
+            if before and stats['p95_ms'] > before['p95_ms'] * (1 + threshold):
+                regressions.append('{} questions, {}: p95 {:.2f} ms -> '
+                                   '{:.2f} ms'.format(size, route,
+                                                      before['p95_ms'],
+                                                      stats['p95_ms']))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Benchmark the trivia API routes.')
+    parser.add_argument(
+        '--database-url', default=os.getenv(
+            'BENCH_DATABASE_URL', 'sqlite:///' + os.path.join(
+                tempfile.gettempdir(), 'trivia_bench.db')),
+        help='dedicated database, emptied before seeding')
+    parser.add_argument('--sizes', default='1000,100000,1000000',
+                        help='comma separated numbers of questions')
+    parser.add_argument('--category-skew', type=float, default=0.0,
+                        help='skew of the questions over the categories, '
+                             'as for flask seed')
+    parser.add_argument('--id-gap', type=int, default=0,
+                        help='sparse question ids, as for flask seed')
+    parser.add_argument('--requests', type=int, default=200,
+                        help='requests per route and size')
+    parser.add_argument('--concurrency', type=int, default=8,
+                        help='concurrent clients')
+    parser.add_argument('--routes', default=None,
+                        help='comma separated routes, all by default')
+    parser.add_argument('--server', action='store_true',
+                        help='go through HTTP to a local WSGI server')
+    parser.add_argument('--asgi', action='store_true',
+                        help='go through HTTP to a local ASGI server '
+                             '(needs uvicorn)')
+    parser.add_argument('--save', help='write the results to this file')
+    parser.add_argument('--compare', help='baseline results to compare to')
+    parser.add_argument('--threshold', type=float, default=0.25,
+                        help='tolerated p95 regression, as a fraction')
+    args = parser.parse_args(argv)
+
+    config = {'SQLALCHEMY_DATABASE_URI': args.database_url}
+    server = asgi_server = None
+    if args.asgi:
+        asgi_app = create_asgi_app(config)
+        app = asgi_app.wsgi_app
+        asgi_server, port = start_asgi_server(asgi_app)
+
+        def make_client():
+            return HTTPClient(port)
+    elif args.server:
+        app = create_app(config)
+        server = make_server('127.0.0.1', 0, app, threaded=True,
+                             request_handler=QuietRequestHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+
+        def make_client():
+            return HTTPClient(server.server_port)
+    else:
+        app = create_app(config)
+
+        def make_client():
+            return TestClient(app)
+
+    results = {}
+    with app.app_context():
+        counter = QueryCounter(db.engine)
+        for size in [int(size) for size in args.sizes.split(',')]:
+            print('seeding {} questions...'.format(size), file=sys.stderr)
+            category_ids = seed(size, args.category_skew, args.id_gap)
+            routes = scenarios(size, category_ids)
+            if args.routes:
+                routes = {name: routes[name]
+                          for name in args.routes.split(',')}
+
+            results[str(size)] = {}
+            for route, scenario in routes.items():
+                # warm up caches and connections before measuring
+                run_scenario(make_client, scenario, args.concurrency,
+                             args.concurrency, counter)
+                results[str(size)][route] = run_scenario(
+                    make_client, scenario, args.requests,
+                    args.concurrency, counter)
+            print_results(size, results[str(size)])
+
+    if server is not None:
+        server.shutdown()
+    if asgi_server is not None:
+        asgi_server.should_exit = True
+
+    if args.save:
+        with open(args.save, 'w') as output:
+            json.dump(results, output, indent=2)
+
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            regressions = find_regressions(
+                results, json.load(baseline_file), args.threshold)
+        for regression in regressions:
+            print('REGRESSION ' + regression)
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,84 @@
+import os
+import threading
+import time
+
+from models import Category, on_change
+from replicas import primary
+
+CATEGORY_CACHE_TTL = float(os.getenv('CATEGORY_CACHE_TTL', 300))
+
+# a lookup of an unknown category reloads the map, at most once in this
+# many seconds, so that bogus ids can't send a query each
+CATEGORY_MISS_RELOAD_SECONDS = float(
+    os.getenv('CATEGORY_MISS_RELOAD_SECONDS', 1))
+
+"""
+CategoryCache
+    keeps every category in memory as an {id: type} map so that routes
+    don't query the categories table on each request. the map is loaded
+    on first use and dropped whenever a category is written through the
+    model helpers. entries also expire after `ttl` seconds so that writes
+    made by other worker processes are eventually picked up, and an
+    unknown category is looked for again in a fresh map before being
+    reported missing, as another worker may have just created it
+"""
+
+
+class CategoryCache:
+
+    def __init__(self, ttl=CATEGORY_CACHE_TTL,
+                 miss_reload_seconds=CATEGORY_MISS_RELOAD_SECONDS):
+        self.ttl = ttl
+        self.miss_reload_seconds = miss_reload_seconds
+        self.hits = 0
+        self.misses = 0
+        self._types = None
+        self._loaded_at = 0
+        self._lock = threading.Lock()
+
+    def _load(self):
+        with self._lock:
+            self.misses += 1
+            with primary():
+                types = Category.id_type_map()
+            self._types = types
+            self._loaded_at = time.monotonic()
+        return types
+
+    def id_type_map(self):
+        # returns the shared {id: type} map, callers must not modify it
+        types = self._types
+        if types is None or time.monotonic() - self._loaded_at >= self.ttl:
+            return self._load()
+        self.hits += 1
+        return types
+
+    def _map_with(self, category_id):
+        # the map, reloaded if it doesn't hold category_id
+        types = self.id_type_map()
+        if (category_id not in types and
+                time.monotonic() - self._loaded_at >=
+                self.miss_reload_seconds):
+            types = self._load()
+        return types
+
+    def exists(self, category_id):
+        return category_id in self._map_with(category_id)
+
+    def type_of(self, category_id):
+        return self._map_with(category_id).get(category_id)
+
+    def invalidate(self, *args):
+        self._types = None
+
+    def stats(self):
+        types = self._types
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'size': len(types) if types is not None else 0,
+        }
+
+
+category_cache = CategoryCache()
+on_change('categories', category_cache.invalidate)
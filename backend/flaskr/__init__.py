@@ -1,23 +1,85 @@
+import io
 import os
 import math
 from re import search
 from unicodedata import category
-from flask import Flask, request, abort, jsonify
+import click
+from flask import Flask, request, abort, Response, stream_with_context
 from flask_sqlalchemy import SQLAlchemy
-from flask_migrate import Migrate
+from flask_migrate import Migrate, upgrade
 from flask_cors import CORS
-import random
-
-from models import setup_db, Question, Category, db
+from sqlalchemy import inspect
+from sqlalchemy.exc import IntegrityError
+
+from models import setup_db, Question, Category, db, database_path, \
+    pool_stats, replica_binds
+from answer_matching import answers_match
+from category_cache import category_cache
+from instrumentation import start_request, finish_request, current_stats
+from leaderboard import leaderboard, MemoryLeaderboardStore
+from metrics import registry, record_request, errors_total, \
+    CONTENT_TYPE as METRICS_CONTENT_TYPE
+from pagination import count_cache, count_rows, paginate, paginate_after
+from question_io import validate_question, import_questions, \
+    iter_export_rows, InvalidQuestion, IMPORT_BATCH_SIZE, READERS, \
+    WRITERS, EXPORT_MIMETYPES
+from question_search import find_questions, iter_questions, categories_of
+from quiz_selection import question_pools, difficulty_bounds, \
+    previous_question_ids, questions_in_category
+from quiz_sessions import QuizSessions, MemorySessionStore
+from replicas import ReplicaRouter, read_only, REPLICA_STICKY_SECONDS
+from response_cache import response_cache, MemoryResponseStore
+from seeding import seed_database, clear_database
+from serialization import json_response, dumps, question_rows, \
+    format_questions
 
 QUESTIONS_PER_PAGE = 10
+SEARCH_RESULTS_LIMIT = 100
+QUESTIONS_PER_ROUND = 5
+# questions of the pools missing from the database, deleted by another
+# worker or not on the replica yet, skipped before a quiz gives up
+MAX_MISSING_QUESTIONS = 8
+MAX_QUESTIONS_PER_ROUND = 50
+LEADERBOARD_SIZE = 10
+MAX_LEADERBOARD_SIZE = 100
+MAX_PLAYER_NAME_LENGTH = 64
+
+# requests slower than this are logged with their slowest query
+SLOW_REQUEST_MS = float(os.getenv('SLOW_REQUEST_MS', 500))
+
+MIGRATIONS_DIRECTORY = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    'migrations')
 
 
 def create_app(test_config=None):
     # create and configure the app
     app = Flask(__name__)
-    setup_db(app)
-    migrate = Migrate(app, db)
+    if test_config is not None:
+        app.config.from_mapping(test_config)
+    app.config.setdefault('SLOW_REQUEST_MS', SLOW_REQUEST_MS)
+    setup_db(app, app.config.get('SQLALCHEMY_DATABASE_URI', database_path))
+    # creating the app doesn't touch the database, which is only
+    # connected to by the first request
+    migrate = Migrate(app, db, directory=MIGRATIONS_DIRECTORY)
+
+    # reads are spread over the replicas, if any
+    replica_router = ReplicaRouter(
+        replica_binds(app.config),
+        app.config.setdefault('REPLICA_STICKY_SECONDS',
+                              REPLICA_STICKY_SECONDS))
+
+    # GET responses are cached in memory unless another store is configured
+    response_cache.configure(
+        app.config.get('RESPONSE_CACHE_STORE') or MemoryResponseStore())
+
+    # the leaderboard is kept in memory unless another store is configured
+    leaderboard.configure(
+        app.config.get('LEADERBOARD_STORE') or MemoryLeaderboardStore(), app)
+
+    # quiz sessions are kept in memory unless another store is configured
+    quiz_sessions = QuizSessions(
+        app.config.get('QUIZ_SESSION_STORE') or MemorySessionStore())
 
     """
     @TODO: Set upCORS. Allow '*' for origins.
@@ -30,13 +92,30 @@ def create_app(test_config=None):
     @TODO: Use the after_request decorator to set Access-Control-Allow
     @TODO: DONE
     """
+    @app.before_request
+    def before_request():
+        # start counting the queries of the request
+        start_request()
+        # pick the database the request reads from
+        replica_router.route_request(app.view_functions.get(request.endpoint))
+
     @app.after_request
     def after_request(response):
         response.headers.add('Access-Control-Allow-Headers',
                              'Content-Type,Authorization,true')
         response.headers.add('Access-Control-Allow-Methods',
                              'GET,PUT,POST,DELETE,OPTIONS')
-        return response
+        # count the request in the metrics
+        stats = current_stats()
+        if stats is not None:
+            route = request.url_rule.rule if request.url_rule else 'unmatched'
+            record_request(route, request.method, response.status_code,
+                           stats.elapsed(), stats.query_count)
+        # keep the reads of a client that wrote on the primary for a while
+        replica_router.finish_request(response)
+        # report the queries of the request, and log it if it was slow
+        return finish_request(
+            response, app.config['SLOW_REQUEST_MS'], app.logger)
 
     """
     @TODO:
@@ -45,6 +124,7 @@ def create_app(test_config=None):
     @TODO: DONE
     """
     @app.route('/categories')
+    @response_cache.cached
     def get_categories():
         """
 
@@ -52,16 +132,11 @@ def create_app(test_config=None):
         WHERE THERE ARE NO CATEGORIES AVAILABLE, IT RETURNS NONE
 
         """
-        # get all existing categories
-        query_all_categories = Category.query.all()
-        all_categories = None
+        # get all existing categories from the category cache
+        all_categories = category_cache.id_type_map() or None
 
-        if query_all_categories:
-            all_categories = {
-                category.id: category.type
-                for category in query_all_categories}
         # return categories
-        return jsonify({
+        return json_response({
             "success": True,
             "categories": all_categories
         })
@@ -84,24 +159,20 @@ def create_app(test_config=None):
         incoming_json = request.get_json()
         new_category_to_create = incoming_json.get('new_category_name')
 
-        # get all existing categories and their names
-        query_all_categories = Category.query.all()
-        all_category_names = [
-            category.type for category in query_all_categories]
-
-        # confirm that name does not currently exist
-        if new_category_to_create in all_category_names:
-            abort(404, "Category already exist")
-
         # create the category
         new_category = Category(
             type=new_category_to_create
         )
 
-        new_category.insert()
+        # the unique index on category names rejects existing names
+        try:
+            new_category.insert()
+        except IntegrityError:
+            db.session.rollback()
+            abort(404, "Category already exist")
 
         # return id of new category
-        return jsonify({
+        return json_response({
             "success": True,
             "category_id": new_category.id
         })
@@ -119,6 +190,7 @@ def create_app(test_config=None):
     Clicking on the page numbers should update the questions.
     """
     @app.route('/questions')
+    @response_cache.cached
     def get_questions():
         """
 
@@ -133,14 +205,12 @@ def create_app(test_config=None):
         # get page number with default as 1
         page_number = request.args.get("page", 1, type=int)
 
-        # get all questions
-        all_questions_query = Question.query.all()
+        # opt-in keyset pagination: the id of the last question seen
+        after_id = request.args.get("after_id", None, type=int)
 
-        # get all categories
-        all_categories_query = Category.query.all()
-
-        # get total questions
-        totalQuestions = len(all_questions_query)
+        # get total questions from the cached COUNT(*)
+        totalQuestions = count_rows(
+            Question.query, Question.id, 'questions')
 
         # get total pages
         total_pages = math.ceil(totalQuestions / QUESTIONS_PER_PAGE)
@@ -150,44 +220,44 @@ def create_app(test_config=None):
         all_questions = None
         all_categories = None
 
-        if page_number > total_pages and totalQuestions >= 1:
-            abort(404, 'Page number out of range')
+        if after_id is None:
+            if page_number > total_pages and totalQuestions >= 1:
+                abort(404, 'Page number out of range')
 
-        if page_number < 1:
-            abort(404, 'Invalid page number')
+            if page_number < 1:
+                abort(404, 'Invalid page number')
 
-        # Get first and last question of the page
-        start = (page_number - 1) * QUESTIONS_PER_PAGE
-        end = start + 10
-
-        if not all_categories_query:
-            all_categories = None
+            # let the database pick the rows of the page
+            page_questions = paginate(
+                question_rows(Question.query), Question.id,
+                page_number, QUESTIONS_PER_PAGE)
         else:
-            all_categories = {
-                category.id: category.type
-                for category in all_categories_query}
+            # let the database pick the rows following after_id
+            page_questions = paginate_after(
+                question_rows(Question.query), Question.id,
+                after_id, QUESTIONS_PER_PAGE)
 
-        if not all_questions_query:
-            all_questions = None
-        else:
-            all_questions = [{
-                "id": question.id,
-                "question": question.question,
-                "answer": question.answer,
-                "category": question.category,
-                "difficulty": question.difficulty,
-
-            }
-                for question in all_questions_query[start:end]
-            ]
-        # return questions and categories
-        return jsonify({
+        # get all categories from the category cache
+        all_categories = category_cache.id_type_map() or None
+
+        if page_questions:
+            all_questions = format_questions(page_questions)
+
+        response = {
             "success": True,
             "questions": all_questions,
             "categories": all_categories,
-            "totalQuestions": len(all_questions_query)
+            "totalQuestions": totalQuestions
         }
-        )
+
+        # the cursor to pass as after_id to get the next page
+        if after_id is not None:
+            response["next_after_id"] = (
+                page_questions[-1].id
+                if len(page_questions) == QUESTIONS_PER_PAGE else None)
+
+        # return questions and categories
+        return json_response(response)
     """
     @TODO:
     Create an endpoint to DELETE question using a question ID.
@@ -219,7 +289,7 @@ def create_app(test_config=None):
             abort(500, "Could not delete question")
 
         # return id of deleted question
-        return jsonify({
+        return json_response({
             "success": True,
             "deleted_id": question_id
         })
@@ -242,33 +312,82 @@ def create_app(test_config=None):
         WITH BAD FORMAT SUCH AS EMPTY QUESTION OR ANSWER TEXT
         THE OPERATION ABORTS WITH NOTIFICATION TO THE FRONT-END
         """
-        # retrieve question data
+        # retrieve and validate question data
         incoming_question = request.get_json()
-        question = incoming_question['question']
-        answer = incoming_question['answer']
-        category = incoming_question['category']
-        difficulty = incoming_question['difficulty']
-
-        if category is None:
-            abort(404, 'No category found')
-
-        elif question == '':
-            abort(422, "Missing question text")
-
-        elif answer == '':
-            abort(422, "Missing answer text")
+        try:
+            question_data = validate_question(incoming_question)
+        except InvalidQuestion as invalid:
+            abort(invalid.status, invalid.message)
 
         # form the Question object
-        question_to_create = Question(
-            question, answer, category, difficulty
-        )
-
-        # insert into the database
-        question_to_create.insert()
-        return jsonify({
+        question_to_create = Question(**question_data)
+
+        # insert into the database, the foreign key
+        # rejects categories that do not exist
+        try:
+            question_to_create.insert()
+        except IntegrityError:
+            db.session.rollback()
+            abort(404, 'No category found')
+        return json_response({
             "success": True,
             "created_id": question_to_create.id
         })
+
+    @app.route('/questions/bulk', methods=['POST'])
+    def bulk_add_questions():
+        """
+        THIS ENDPOINT CREATES MANY QUESTIONS AT ONCE FROM A JSON LINES
+        BODY, OR A CSV BODY WITH A HEADER WHEN THE CONTENT TYPE IS text/csv.
+        ROWS ARE VALIDATED LIKE NEW QUESTIONS AND WRITTEN IN BATCHES;
+        INVALID ROWS ARE REPORTED WITHOUT ABORTING THE IMPORT
+        """
+        # get the format of the body and the size of the batches
+        file_format = request.args.get(
+            'format', 'csv' if request.mimetype == 'text/csv' else 'jsonl')
+        batch_size = request.args.get(
+            'batch_size', IMPORT_BATCH_SIZE, type=int)
+        if file_format not in READERS:
+            abort(422, 'Unknown format')
+        if batch_size < 1:
+            abort(422, 'Invalid batch size')
+
+        # read the body as it arrives instead of loading it whole
+        lines = io.TextIOWrapper(request.stream, encoding='utf-8',
+                                 newline='')
+        report = import_questions(READERS[file_format](lines), batch_size)
+
+        response = report.format()
+        response['success'] = True
+        return json_response(response)
+
+    @app.route('/questions/export')
+    def export_questions():
+        """
+        THIS ENDPOINT STREAMS EVERY QUESTION, OR EVERY QUESTION OF A
+        CATEGORY, AS JSON LINES OR CSV. ROWS ARE READ FROM THE DATABASE
+        IN BATCHES WHILE THE RESPONSE IS SENT
+        """
+        file_format = request.args.get('format', 'jsonl')
+        if file_format not in WRITERS:
+            abort(422, 'Unknown format')
+        # a category that isn't a number must not export the whole bank
+        category_id = request.args.get('category')
+        if category_id is not None:
+            try:
+                category_id = int(category_id)
+            except ValueError:
+                abort(422, 'Invalid category')
+        if category_id is not None and not category_cache.exists(category_id):
+            abort(404, 'Category does not exist')
+
+        lines = WRITERS[file_format](iter_export_rows(category_id))
+        response = Response(stream_with_context(lines),
+                            mimetype=EXPORT_MIMETYPES[file_format])
+        response.headers['Content-Disposition'] = \
+            'attachment; filename=questions.' + file_format
+        return response
+
     """
     @TODO:
     Create a POST endpoint to get questions based on a search term.
@@ -280,46 +399,59 @@ def create_app(test_config=None):
     Try using the word "title" to start.
     """
     @app.route('/questions/search', methods=['POST'])
+    @read_only
     def search_questions():
         """
         THIS ENDPOINT SEARCHES THE DB FOR A QUESTION TEXT
-        AND RETURNS ALL MATCHING QUESTIONS
+        AND RETURNS MATCHING QUESTIONS, BEST MATCH FIRST, IN PAGES OF
+        AT MOST 100 QUESTIONS. WITH "stream" SET, IT STREAMS ALL MATCHING
+        QUESTIONS AS NEWLINE-DELIMITED JSON INSTEAD
         """
         # get incoming json object and retrieve the search term
         incoming_json_object = request.get_json()
-        search_term = incoming_json_object['searchTerm']
-        search_query = Question.query.filter(
-            Question.question.ilike(f'%{search_term}%')).all()
+        search_term = incoming_json_object.get('searchTerm')
+        if not isinstance(search_term, str):
+            abort(422, 'Invalid search term')
+
+        # stream every match as JSON lines when requested
+        if incoming_json_object.get('stream'):
+            def generate():
+                for question in iter_questions(search_term):
+                    yield dumps(question.format()) + b'\n'
+            return Response(stream_with_context(generate()),
+                            mimetype='application/x-ndjson')
+
+        # get page number and page size, the page size being capped
+        try:
+            page_number = int(incoming_json_object.get('page', 1))
+            page_size = min(int(incoming_json_object.get(
+                'limit', SEARCH_RESULTS_LIMIT)), SEARCH_RESULTS_LIMIT)
+        except (TypeError, ValueError):
+            abort(422, 'Invalid page number or limit')
+        if page_number < 1 or page_size < 1:
+            abort(422, 'Invalid page number or limit')
+
+        search_query, total_questions = find_questions(
+            search_term, page_number, page_size)
 
         # if the search query does not exist, return no item found
-        if not search_query:
+        if not total_questions:
             abort(404, "No item found")
 
+        if not search_query:
+            abort(404, 'Page number out of range')
+
         # return categories of found questions
-        search_categories = [
-            question.category
-            for question in
-            Question.query.filter(
-                Question.question.ilike(
-                    f'%{search_term}%')).
-            distinct(Question.category).
-            all()
-        ]
+        search_categories = categories_of(search_query)
 
         # return search result
-        return jsonify({
+        return json_response({
             'searchTerm': search_term,
             'success': True,
-            'questions': [{
-                'id': question.id,
-                'question': question.question,
-                'answer': question.answer,
-                'category': question.category,
-                'difficulty': question.difficulty
-            } for question in search_query
-            ],
+            'questions': format_questions(search_query),
             'categories': search_categories,
-            'total_questions': len(search_query)
+            'total_questions': total_questions,
+            'page': page_number
 
         })
 
@@ -332,46 +464,74 @@ def create_app(test_config=None):
     category to be shown.
     """
     @app.route('/categories/<category_id>/questions')
+    @response_cache.cached
     def get_questions_by_category(category_id):
         """
-        THIS ENDPOINT FETCHES ALL QUESTIONS IN A PARTICULAR CATEGORY
-        USING THE CATEGORY_ID RECEIVED FROM THE FRONT-END
+        THIS ENDPOINT FETCHES THE QUESTIONS IN A PARTICULAR CATEGORY
+        USING THE CATEGORY_ID RECEIVED FROM THE FRONT-END, IN PAGES OF
+        TEN QUESTIONS EACH LIKE GET /questions. WITH count_only=1
+        IT ONLY RETURNS THE NUMBER OF QUESTIONS IN THE CATEGORY
 
         """
-        # retrieve ids of all categories in the database
-        all_categories_ids = [category.id for category in Category.query.all()]
         this_category_id = int(category_id)
-        questions_in_category = None
 
-        # if no category_id is specified, get all questions
-        # otherwise, retrieve questions from a particular category
-        if this_category_id == 0:
-            questions_in_category = Question.query.all()
-        elif this_category_id not in all_categories_ids:
+        # get page number with default as 1, or the keyset cursor
+        page_number = request.args.get("page", 1, type=int)
+        after_id = request.args.get("after_id", None, type=int)
+        count_only = request.args.get("count_only", 0, type=int)
+
+        # if no category_id is specified, use all questions
+        # otherwise, use questions from a particular category
+        if (this_category_id != 0 and
+                not category_cache.exists(this_category_id)):
             abort(404, "Category does not exist")
-        else:
-            questions_in_category = Question.query.filter(
-                Question.category == category_id).all()
-        if not questions_in_category:
+        category_query = questions_in_category(this_category_id)
+
+        # get total questions in category from the cached COUNT(*)
+        totalQuestions = count_rows(
+            category_query, Question.id, ('category', this_category_id))
+
+        if count_only:
+            return json_response({
+                'totalQuestions': totalQuestions,
+                'currentCategory': this_category_id,
+                'success': True
+            })
+
+        if not totalQuestions:
             abort(404, "No question in category")
 
-        # return all questions retrieved from the database
-        # belonging to the category
-        return jsonify({
-            'totalQuestions': len(questions_in_category),
+        if after_id is None:
+            if page_number < 1:
+                abort(404, 'Invalid page number')
+
+            if page_number > math.ceil(totalQuestions / QUESTIONS_PER_PAGE):
+                abort(404, 'Page number out of range')
+
+            questions_in_page = paginate(
+                question_rows(category_query), Question.id,
+                page_number, QUESTIONS_PER_PAGE)
+        else:
+            questions_in_page = paginate_after(
+                question_rows(category_query), Question.id,
+                after_id, QUESTIONS_PER_PAGE)
+
+        # return the questions of the page belonging to the category
+        response = {
+            'totalQuestions': totalQuestions,
             'currentCategory': this_category_id,
             'success': True,
-            'questions': [{
-                'id': question.id,
-                'question': question.question,
-                'answer': question.answer,
-                'category': question.category,
-                'difficulty': question.difficulty,
-            }
-                for question in questions_in_category
-            ],
+            'questions': format_questions(questions_in_page),
 
-        })
+        }
+
+        # the cursor to pass as after_id to get the next page
+        if after_id is not None:
+            response['next_after_id'] = (
+                questions_in_page[-1].id
+                if len(questions_in_page) == QUESTIONS_PER_PAGE else None)
+
+        return json_response(response)
     """
     @TODO:
     Create a POST endpoint to get questions to play the quiz.
@@ -384,6 +544,7 @@ def create_app(test_config=None):
     and shown whether they were correct or not.
     """
     @app.route('/quizzes', methods=['POST'])
+    @read_only
     def get_quiz_play():
         """
         THIS ENDPOINT ALLOWS THE USER TO PLAY THE TRIVIA GAME BY
@@ -394,68 +555,297 @@ def create_app(test_config=None):
         # Get category index
         incoming_json = request.get_json()
         current_category_index = int(incoming_json.get('quiz_category'))
-        all_questions_in_categories = None
 
-        # Get all category indices
-        all_category_indices = [
-            category.id for category in Category.query.all()]
-
-        # If No particular category is specified, get questions from all
-        # categories is requested
-        if current_category_index == 0:
-            all_questions_in_categories = Question.query.all()
-
-        # Otherwise verify the category index is valid
-        elif current_category_index in all_category_indices:
-            # then get all questions in the category
-            all_questions_in_categories = Question.query.filter(
-                Question.category == current_category_index).all()
-
-        # abort if no question in the selected category
-        if not all_questions_in_categories:
+        # abort if the category does not exist
+        if (current_category_index != 0 and
+                not category_cache.exists(current_category_index)):
             abort(404, 'No question or category')
 
         # This line retrieves all questions already answered in the current
         # game session
-        previous_questions = incoming_json.get('previous_questions')
+        try:
+            previous_questions = previous_question_ids(incoming_json)
+        except (TypeError, ValueError):
+            abort(422, 'Invalid previous_questions')
+
+        # a single difficulty level or a range of levels, if any
+        try:
+            bounds = difficulty_bounds(incoming_json)
+        except (TypeError, ValueError):
+            abort(422, 'Invalid difficulty')
+
+        # draw a random question of the category (or of all categories
+        # when none is specified) that was not previously played, from
+        # the question pools held in memory
+        this_question = None
+        for _ in range(MAX_MISSING_QUESTIONS):
+            question_id = question_pools.draw(
+                current_category_index, bounds, previous_questions)
+            if question_id is None:
+                break
+            this_question = Question.query.get(question_id)
+            if this_question is not None:
+                break
+            previous_questions.add(question_id)
 
-        # These ids are all valid ids related to the current category being
-        # played
-        all_questions_ids = [
-            question.id for question in all_questions_in_categories
-        ]
+        # abort if no question in the selected category, and
+        # when there are no more new question, notify the user
+        if this_question is None:
+            if not question_pools.count(current_category_index, bounds):
+                abort(404, 'No question or category')
+            abort(404, 'No new question')
 
-        # When there are no more new question, notify the user and abort
-        if len(previous_questions) >= len(all_questions_ids):
+        # return the question to client
+        return json_response({
+
+            'question': this_question.format(),
+            'success': True,
+            'question_id': this_question.id
+        })
+
+    @app.route('/quizzes/round', methods=['POST'])
+    @read_only
+    def get_quiz_round():
+        """
+        THIS ENDPOINT RETURNS A WHOLE ROUND OF DISTINCT RANDOM QUESTIONS
+        OF A CATEGORY (OR ALL CATEGORIES WITH 0) THAT WERE NOT PREVIOUSLY
+        PLAYED, SO THE CLIENT CAN PREFETCH THE ROUND IN ONE REQUEST
+
+        """
+        incoming_json = request.get_json()
+        try:
+            current_category_index = int(incoming_json.get('quiz_category'))
+            count = int(incoming_json.get('count', QUESTIONS_PER_ROUND))
+        except (TypeError, ValueError):
+            abort(422, 'Invalid quiz_category or count')
+        if not 0 < count <= MAX_QUESTIONS_PER_ROUND:
+            abort(422, 'Invalid quiz_category or count')
+
+        if (current_category_index != 0 and
+                not category_cache.exists(current_category_index)):
+            abort(404, 'No question or category')
+
+        try:
+            bounds = difficulty_bounds(incoming_json)
+        except (TypeError, ValueError):
+            abort(422, 'Invalid difficulty')
+        try:
+            previous_questions = previous_question_ids(incoming_json)
+        except (TypeError, ValueError):
+            abort(422, 'Invalid previous_questions')
+
+        # draw the ids from the question pools, then read the questions
+        # in a single query, returned in the order they were drawn
+        question_ids = question_pools.sample(
+            current_category_index, count, bounds, previous_questions)
+        rows = {}
+        if question_ids:
+            rows = {row.id: row for row in question_rows(
+                Question.query.filter(Question.id.in_(question_ids)))}
+        # questions deleted by another worker since the pools were read
+        # are left out of the round
+        question_ids = [question_id for question_id in question_ids
+                        if question_id in rows]
+
+        if not question_ids:
+            if not question_pools.count(current_category_index, bounds):
+                abort(404, 'No question or category')
             abort(404, 'No new question')
 
-        random_int = -1
+        return json_response({
+            'questions': format_questions(
+                rows[question_id] for question_id in question_ids),
+            'question_ids': question_ids,
+            'success': True
+        })
 
-        # if there are new questions, select a random question from the pool
-        while True:
-            random_int = random.randint(
-                min(all_questions_ids), max(all_questions_ids))
-            if (random_int not in previous_questions and
-                    random_int in all_questions_ids):
-                break
-        if random_int > 0:
-            this_question = Question.query.get(random_int)
-
-        random_question = {
-            'id': this_question.id,
-            'question': this_question.question,
-            'answer': this_question.answer,
-            'category': this_question.category,
-            'difficulty': this_question.difficulty
-        }
+    @app.route('/quizzes/sessions', methods=['POST'])
+    @read_only
+    def start_quiz_session():
+        """
+        THIS ENDPOINT STARTS A QUIZ SESSION FOR A CATEGORY (OR ALL
+        CATEGORIES WITH 0). THE QUESTIONS OF THE CATEGORY ARE SHUFFLED ONCE
+        AND KEPT ON THE SERVER, SO THE CLIENT ONLY SENDS THE SESSION ID
+        TO GET THE NEXT QUESTION
+        """
+        # Get category index
+        incoming_json = request.get_json()
+        current_category_index = int(incoming_json.get('quiz_category'))
 
-        # return the question to client
-        return jsonify({
+        # abort if the category does not exist
+        if (current_category_index != 0 and
+                not category_cache.exists(current_category_index)):
+            abort(404, 'No question or category')
+
+        # get the ids of all questions in the category
+        question_ids = Question.ids_in_category(current_category_index)
+        if not question_ids:
+            abort(404, 'No question or category')
 
-            'question': random_question,
+        # shuffle them into the deck of a new session
+        session_id = quiz_sessions.start(current_category_index, question_ids)
+
+        return json_response({
             'success': True,
-            'question_id': this_question.id
+            'session_id': session_id,
+            'total_questions': len(question_ids)
+        })
+
+    @app.route('/quizzes/sessions/<session_id>/next', methods=['POST'])
+    @read_only
+    def next_quiz_session_question(session_id):
+        """
+        THIS ENDPOINT RETURNS THE NEXT QUESTION OF A QUIZ SESSION.
+        WHEN ALL QUESTIONS OF THE SESSION HAVE BEEN PLAYED
+        IT NOTIFIES THE USER
+        """
+        this_question = None
+        while this_question is None:
+            # take the next id from the session deck
+            try:
+                question_id = quiz_sessions.next_question_id(session_id)
+            except KeyError:
+                abort(404, 'Quiz session not found')
+            if question_id is None:
+                abort(404, 'No new question')
+
+            # skip questions deleted since the session started
+            this_question = Question.query.get(question_id)
+
+        session = quiz_sessions.get(session_id)
+        return json_response({
+            'question': this_question.format(),
+            'success': True,
+            'question_id': this_question.id,
+            'remaining_questions': len(session.deck) - session.cursor
         })
+
+    @app.route('/quizzes/sessions/<session_id>', methods=['DELETE'])
+    def finish_quiz_session(session_id):
+        """
+        THIS ENDPOINT ENDS A QUIZ SESSION AND RETURNS
+        HOW MANY QUESTIONS WERE PLAYED
+        """
+        session = quiz_sessions.finish(session_id)
+        if session is None:
+            abort(404, 'Quiz session not found')
+
+        return json_response({
+            'success': True,
+            'session_id': session_id,
+            'questions_played': session.cursor
+        })
+
+    @app.route('/quizzes/answer', methods=['POST'])
+    @read_only
+    def check_quiz_answer():
+        """
+        THIS ENDPOINT CHECKS THE ANSWER OF A PLAYER TO A QUESTION,
+        FORGIVING CASE, ACCENTS, PUNCTUATION AND SMALL TYPOS, AND
+        ADDS A POINT TO THE SCORE OF THE PLAYER WHEN THEIR FIRST
+        ANSWER TO THE QUESTION IS CORRECT
+        """
+        incoming_json = request.get_json() or {}
+        player = incoming_json.get('player')
+        answer = incoming_json.get('answer')
+        try:
+            question_id = int(incoming_json.get('question_id'))
+        except (TypeError, ValueError):
+            abort(422, 'Invalid answer')
+        if (not isinstance(player, str) or not player.strip() or
+                len(player) > MAX_PLAYER_NAME_LENGTH or
+                not isinstance(answer, str)):
+            abort(422, 'Invalid answer')
+
+        row = db.session.query(Question.answer).filter(
+            Question.id == question_id).first()
+        if row is None:
+            abort(404, 'Question not found')
+
+        correct = answers_match(answer, row.answer)
+        # every first answer of a player to a question is recorded, right
+        # or wrong, and only a right one scores: the expected answer sent
+        # back after a wrong one can't be submitted again for a point
+        first = leaderboard.record(player, question_id, 1 if correct else 0)
+        scored = correct and first
+        standing = leaderboard.standing(player)
+
+        return json_response({
+            'success': True,
+            'correct': correct,
+            'scored': scored,
+            'answer': row.answer,
+            'player': player,
+            'rank': standing[0] if standing else None,
+            'score': standing[1] if standing else 0
+        })
+
+    @app.route('/leaderboard')
+    def get_leaderboard():
+        """
+        THIS ENDPOINT RETURNS THE BEST PLAYERS, LIMITED
+        BY THE limit QUERY PARAMETER
+        """
+        limit = request.args.get('limit', LEADERBOARD_SIZE, type=int)
+        if not 0 < limit <= MAX_LEADERBOARD_SIZE:
+            abort(422, 'Invalid limit')
+
+        return json_response({
+            'success': True,
+            'leaderboard': [
+                {'rank': rank, 'player': player, 'score': score}
+                for rank, (player, score) in enumerate(
+                    leaderboard.top(limit), 1)],
+            'total_players': leaderboard.players()
+        })
+
+    @app.route('/leaderboard/<player>')
+    def get_player_standing(player):
+        """
+        THIS ENDPOINT RETURNS THE RANK AND SCORE OF A PLAYER
+        """
+        standing = leaderboard.standing(player)
+        if standing is None:
+            abort(404, 'Player not found')
+
+        return json_response({
+            'success': True,
+            'player': player,
+            'rank': standing[0],
+            'score': standing[1]
+        })
+
+    # values read from the rest of the app when metrics are scraped
+    registry.gauge(
+        'trivia_db_pool_connections', 'Connections of the database pool.',
+        ('state',),
+        lambda: [((state,), value) for state, value in pool_stats().items()
+                 if state in ('size', 'checkedin', 'checkedout', 'overflow')])
+    registry.callback_counter(
+        'trivia_cache_requests_total', 'Lookups in the in-process caches.',
+        ('cache', 'result'),
+        lambda: [((name, result), cache.stats()[key])
+                 for name, cache in (('category', category_cache),
+                                     ('count', count_cache),
+                                     ('response', response_cache))
+                 for result, key in (('hit', 'hits'), ('miss', 'misses'))])
+    registry.gauge(
+        'trivia_leaderboard_pending_players',
+        'Players whose points are waiting for the next batch.', (),
+        lambda: [((), leaderboard.stats()['pending'])])
+    registry.callback_counter(
+        'trivia_leaderboard_flushes_total',
+        'Batches of points written to the database.', (),
+        lambda: [((), leaderboard.stats()['flushes'])])
+
+    @app.route('/metrics')
+    def get_metrics():
+        """
+        THIS ENDPOINT EXPOSES THE METRICS OF THE APP
+        IN THE PROMETHEUS TEXT FORMAT
+        """
+        return Response(registry.render(), content_type=METRICS_CONTENT_TYPE)
+
     """
     @TODO:
     Create error handlers for all expected errors
@@ -463,43 +853,131 @@ def create_app(test_config=None):
     """
     @app.errorhandler(404)
     def resource_not_found(error):
-        response = jsonify({
+        response = json_response({
             'message': error.description,
             'success': False,
         })
         response.status_code = 404
+        errors_total.inc(('404',))
         return response
 
     @app.errorhandler(400)
     def unknown_request(error):
-        response = jsonify({
+        response = json_response({
             'message': error.description,
             'success': False,
         })
         response.status_code = 400
+        errors_total.inc(('400',))
         return response
 
     @app.errorhandler(422)
     def invalid_data(error):
-        response = jsonify({
+        response = json_response({
             'message': error.description,
             'success': False,
         })
         response.status_code = 422
+        errors_total.inc(('422',))
         return response
 
     @app.errorhandler(500)
     def server_error(error):
-        response = jsonify({
-            'message': error.description,
+        # unhandled exceptions reach this handler as they were raised
+        response = json_response({
+            'message': getattr(error, 'description',
+                               'Internal server error'),
             'success': False,
         })
         response.status_code = 500
+        errors_total.inc(('500',))
         return response
 
+    @app.cli.command('init-db')
+    @click.option('--drop', is_flag=True,
+                  help='drop the existing tables first, losing their data')
+    def init_db_command(drop):
+        """Create the database schema by running the migrations."""
+        if drop:
+            db.drop_all()
+            db.engine.execute('DROP TABLE IF EXISTS alembic_version')
+        tables = inspect(db.engine).get_table_names()
+        if 'questions' in tables and 'alembic_version' not in tables:
+            raise click.ClickException(
+                'the tables exist but were not created by the migrations, '
+                'mark them with flask db stamp first')
+        upgrade()
+        click.echo('the database schema is up to date')
+
+    @app.cli.command('seed')
+    @click.option('--categories', type=click.IntRange(min=1), default=6,
+                  show_default=True, help='categories to add')
+    @click.option('--questions', type=click.IntRange(min=0), default=1000,
+                  show_default=True, help='questions to add')
+    @click.option('--category-skew', default=0.0, show_default=True,
+                  help='0 spreads questions evenly over the categories, '
+                       '1 or more piles them up in the first ones')
+    @click.option('--difficulty-weights', default='1,1,1,1,1',
+                  show_default=True,
+                  help='relative weights of the difficulties 1 to 5')
+    @click.option('--id-gap', type=click.IntRange(min=0), default=0,
+                  show_default=True,
+                  help='skip up to this many ids after each question')
+    @click.option('--seed', type=int, help='random seed, for repeatable data')
+    @click.option('--reset', is_flag=True,
+                  help='delete every question and category first')
+    def seed_command(categories, questions, category_skew,
+                     difficulty_weights, id_gap, seed, reset):
+        """Add synthetic categories and questions to the database."""
+        try:
+            weights = [float(weight)
+                       for weight in difficulty_weights.split(',')]
+        except ValueError:
+            weights = []
+        if len(weights) != 5:
+            raise click.BadParameter('expected 5 comma separated numbers',
+                                     param_hint='--difficulty-weights')
+        if min(weights) < 0 or not sum(weights):
+            raise click.BadParameter('expected weights of 0 or more, not '
+                                     'all 0',
+                                     param_hint='--difficulty-weights')
+        if reset:
+            clear_database()
+        seed_database(categories, questions, category_skew, weights, id_gap,
+                      seed)
+        click.echo('added {} categories and {} questions'.format(
+            categories, questions))
+
+    @app.cli.command('import-questions')
+    @click.argument('path', type=click.Path(exists=True, dir_okay=False))
+    @click.option('--format', 'file_format', type=click.Choice(READERS),
+                  help='jsonl or csv, guessed from the file extension')
+    @click.option('--batch-size', default=IMPORT_BATCH_SIZE,
+                  show_default=True, help='rows written per bulk insert')
+    def import_questions_command(path, file_format, batch_size):
+        """Import questions from a JSON Lines or CSV file."""
+        if file_format is None:
+            file_format = 'csv' if path.endswith('.csv') else 'jsonl'
+        with open(path, encoding='utf-8', newline='') as lines:
+            report = import_questions(READERS[file_format](lines), batch_size)
+
+        for error in report.errors:
+            click.echo('line {line}: {message}'.format(**error), err=True)
+        click.echo('imported {} questions, rejected {} rows'.format(
+            report.imported, report.error_count))
+
+    @app.cli.command('export-questions')
+    @click.argument('output', type=click.File('w'), default='-')
+    @click.option('--format', 'file_format', type=click.Choice(WRITERS),
+                  default='jsonl', show_default=True)
+    @click.option('--category', 'category_id', type=int,
+                  help='only export the questions of this category id')
+    def export_questions_command(output, file_format, category_id):
+        """Export questions to a JSON Lines or CSV file (stdout by default)."""
+        for line in WRITERS[file_format](iter_export_rows(category_id)):
+            output.write(line)
+
     def cat_index_to_type(id):
-        c = Category.query.get(id)
-        if c is not None:
-            return (c.one()).type
+        return category_cache.type_of(id)
 
     return app
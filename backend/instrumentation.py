@@ -0,0 +1,104 @@
+import time
+
+from flask import g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# statements longer than this are shortened in logs
+MAX_LOGGED_STATEMENT = 500
+
+"""
+RequestStats
+    what the database did for the current request: how many statements
+    it ran, their total duration and the slowest of them
+"""
+
+
+class RequestStats:
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.query_count = 0
+        self.db_time = 0.0
+        self.slowest_time = 0.0
+        self.slowest_statement = None
+
+    def record(self, statement, duration):
+        self.query_count += 1
+        self.db_time += duration
+        if duration > self.slowest_time:
+            self.slowest_time = duration
+            self.slowest_statement = statement
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+
+def current_stats():
+    if has_request_context():
+        return g.get('request_stats')
+    return None
+
+
+# timing every statement of every engine, replicas included
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_cursor_execute(conn, cursor, statement, parameters, context,
+                           executemany):
+    conn.info.setdefault('query_start_times', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_cursor_execute(conn, cursor, statement, parameters, context,
+                          executemany):
+    duration = time.perf_counter() - conn.info['query_start_times'].pop()
+    stats = current_stats()
+    if stats is not None:
+        stats.record(statement, duration)
+
+
+"""
+start_request()
+    starts collecting the statistics of the current request,
+    to be called from a before_request hook
+"""
+
+
+def start_request():
+    g.request_stats = RequestStats()
+
+
+"""
+finish_request(response, slow_request_ms, logger)
+    adds the statistics of the current request to the response as
+    Server-Timing headers, and logs the request when it took longer
+    than slow_request_ms
+"""
+
+
+def finish_request(response, slow_request_ms, logger):
+    stats = current_stats()
+    if stats is None:
+        return response
+
+    total_ms = stats.elapsed() * 1000
+    db_ms = stats.db_time * 1000
+    response.headers.add(
+        'Server-Timing',
+        'db;dur={:.2f};desc="{} queries"'.format(db_ms, stats.query_count))
+    response.headers.add(
+        'Server-Timing',
+        'db-slowest;dur={:.2f}'.format(stats.slowest_time * 1000))
+    response.headers.add('Server-Timing', 'total;dur={:.2f}'.format(total_ms))
+
+    if slow_request_ms is not None and total_ms >= slow_request_ms:
+        statement = stats.slowest_statement or ''
+        if len(statement) > MAX_LOGGED_STATEMENT:
+            statement = statement[:MAX_LOGGED_STATEMENT] + '...'
+        logger.warning(
+            'slow request %s %s: %.1f ms, %d queries in %.1f ms, '
+            'slowest %.1f ms: %s',
+            request.method, request.full_path, total_ms,
+            stats.query_count, db_ms, stats.slowest_time * 1000,
+            ' '.join(statement.split()))
+    return response
@@ -0,0 +1,380 @@
+import bisect
+import os
+import threading
+import time
+
+from flask import current_app
+from sqlalchemy import bindparam
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.exc import SQLAlchemyError
+
+from models import db, Score, Answer, on_change
+from replicas import primary
+
+# scores are written to the database at most this many seconds after
+# they were earned, or as soon as this many players have points pending
+LEADERBOARD_FLUSH_SECONDS = float(os.getenv('LEADERBOARD_FLUSH_SECONDS', 5))
+LEADERBOARD_FLUSH_SIZE = int(os.getenv('LEADERBOARD_FLUSH_SIZE', 500))
+
+"""
+Leaderboard stores: both keep the score of every player ranked, so that
+the top players and the rank of a player are read without sorting.
+MemoryLeaderboardStore keeps them in the worker process, in a dictionary
+and a list of (-score, player) pairs kept sorted: a rank is a binary
+search and the top players a slice. RedisLeaderboardStore shares them
+between workers in a sorted set, through a client with the zincrby,
+zscore, zrevrank, zrevrange, zadd, zcard, setnx and delete methods of
+redis-py. players with the same score are ranked by name in memory and
+by reverse name in Redis
+"""
+
+
+class MemoryLeaderboardStore:
+
+    def __init__(self):
+        self._scores = {}
+        self._ranking = []
+        self._lock = threading.Lock()
+
+    def incr(self, player, points):
+        with self._lock:
+            score = self._scores.get(player)
+            if score is not None:
+                del self._ranking[
+                    bisect.bisect_left(self._ranking, (-score, player))]
+            score = (score or 0) + points
+            self._scores[player] = score
+            bisect.insort(self._ranking, (-score, player))
+            return score
+
+    def score(self, player):
+        return self._scores.get(player)
+
+    def rank(self, player):
+        with self._lock:
+            score = self._scores.get(player)
+            if score is None:
+                return None
+            return bisect.bisect_left(self._ranking, (-score, player))
+
+    def top(self, count):
+        with self._lock:
+            return [(player, -score)
+                    for score, player in self._ranking[:count]]
+
+    def claim_load(self):
+        # a store of the process is loaded by the process alone
+        return True
+
+    def load(self, scores):
+        with self._lock:
+            self._scores = dict(scores)
+            self._ranking = sorted(
+                (-score, player) for player, score in self._scores.items())
+
+    def clear(self):
+        self.load(())
+
+    def __len__(self):
+        return len(self._scores)
+
+
+class RedisLeaderboardStore:
+
+    def __init__(self, client, prefix='trivia:leaderboard'):
+        self.client = client
+        self.key = prefix
+        self.loaded_key = prefix + ':loaded'
+
+    def incr(self, player, points):
+        return int(self.client.zincrby(self.key, points, player))
+
+    def score(self, player):
+        score = self.client.zscore(self.key, player)
+        return None if score is None else int(score)
+
+    def rank(self, player):
+        return self.client.zrevrank(self.key, player)
+
+    def top(self, count):
+        return [(player.decode() if isinstance(player, bytes) else player,
+                 int(score))
+                for player, score in self.client.zrevrange(
+                    self.key, 0, count - 1, withscores=True)]
+
+    def claim_load(self):
+        # only the first worker to start fills the shared sorted set
+        return bool(self.client.setnx(self.loaded_key, 1))
+
+    def load(self, scores):
+        scores = dict(scores)
+        if scores:
+            self.client.zadd(self.key, scores)
+
+    def clear(self):
+        self.client.delete(self.key, self.loaded_key)
+
+    def __len__(self):
+        return self.client.zcard(self.key)
+
+
+"""
+write_scores(answers)
+    writes a {(player, question_id): points} map of first answers to the
+    answers table and adds the points of the answers it inserted to the
+    scores table, in one statement each on Postgres. answers already in
+    the table, given first by another worker, earn nothing: their points
+    are returned as a {player: points} map. the points are added rather
+    than the scores written, so that the batches of several workers add
+    up
+"""
+
+
+def write_scores(answers):
+    table = Answer.__table__
+    # rows in the same order in every batch, so that concurrent batches
+    # lock them in the same order
+    keys = sorted(answers)
+    if not keys:
+        return {}
+    if db.session.bind.dialect.name == 'postgresql':
+        inserted = {tuple(row) for row in db.session.execute(
+            postgresql.insert(table).
+            values([{'player': player, 'question_id': question_id}
+                    for player, question_id in keys]).
+            on_conflict_do_nothing().
+            returning(table.c.player, table.c.question_id))}
+    else:
+        answered = set(db.session.query(Answer.player, Answer.question_id).
+                       filter(Answer.player.in_({key[0] for key in keys}),
+                              Answer.question_id.in_({key[1]
+                                                      for key in keys})))
+        inserted = [key for key in keys if key not in answered]
+        if inserted:
+            db.session.execute(table.insert(), [
+                {'player': player, 'question_id': question_id}
+                for player, question_id in inserted])
+        inserted = set(inserted)
+
+    points, repeated = {}, {}
+    for (player, question_id), value in answers.items():
+        if value:
+            earned = points if (player, question_id) in inserted else repeated
+            earned[player] = earned.get(player, 0) + value
+    if points:
+        _add_points(points)
+    return repeated
+
+
+def _add_points(points):
+    table = Score.__table__
+    rows = [{'player': player, 'score': points[player]}
+            for player in sorted(points)]
+    if db.session.bind.dialect.name == 'postgresql':
+        statement = postgresql.insert(table).values(rows)
+        db.session.execute(statement.on_conflict_do_update(
+            index_elements=[table.c.player],
+            set_={'score': table.c.score + statement.excluded.score}))
+        return
+
+    existing = {player for player, in db.session.query(Score.player).filter(
+        Score.player.in_(list(points)))}
+    if existing:
+        db.session.execute(
+            table.update().
+            where(table.c.player == bindparam('existing_player')).
+            values(score=table.c.score + bindparam('points')),
+            [{'existing_player': row['player'], 'points': row['score']}
+             for row in rows if row['player'] in existing])
+    new_rows = [row for row in rows if row['player'] not in existing]
+    if new_rows:
+        db.session.execute(table.insert(), new_rows)
+
+
+"""
+Leaderboard
+    records the first answers of players and the points they earn in a
+    leaderboard store, which is filled from the scores table on first
+    use and answers the rank and top queries, and writes them to the
+    database in batches: the answers pile up in memory and are written
+    all at once, on the primary, by the request that brings the batch to
+    flush_size players with points or, flush_seconds after the first
+    answer of the batch, by a timer thread in an app context of the app
+    given to configure. a batch that fails is tried again flush_seconds
+    later. only the answers not written yet are held in memory: whether
+    a player answered a question before is otherwise read from the
+    answers table, which has the last word when two workers record the
+    same first answer at once. points earned in the last flush_seconds
+    are lost if the worker stops, while they are still counted in a
+    Redis store
+"""
+
+
+class Leaderboard:
+
+    def __init__(self, store=None, flush_seconds=LEADERBOARD_FLUSH_SECONDS,
+                 flush_size=LEADERBOARD_FLUSH_SIZE):
+        self.store = store if store is not None else MemoryLeaderboardStore()
+        self.flush_seconds = flush_seconds
+        self.flush_size = flush_size
+        self.flushes = 0
+        self._pending = {}
+        self._pending_answers = {}
+        self._writing = {}
+        self._loaded = False
+        self._flushed_at = time.monotonic()
+        self._timer = None
+        self.app = None
+        self._lock = threading.Lock()
+
+    def configure(self, store, app=None):
+        with self._lock:
+            self.store = store
+            self.app = app if app is not None else self.app
+            self._loaded = False
+
+    def _schedule_flush(self):
+        # runs with the lock held, once answers are pending
+        if self._timer is not None or self.app is None:
+            return
+        self._timer = threading.Timer(
+            max(self._flushed_at + self.flush_seconds - time.monotonic(), 0),
+            self._flush_later)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _flush_later(self):
+        with self._lock:
+            self._timer = None
+        with self.app.app_context():
+            self.flush()
+
+    def _load(self):
+        if not self._loaded:
+            if self.store.claim_load():
+                # the last batches may not have reached the replicas
+                with primary():
+                    self.store.load(
+                        db.session.query(Score.player, Score.score).all())
+            self._loaded = True
+
+    def _held(self, answer):
+        # runs with the lock held
+        return answer in self._pending_answers or answer in self._writing
+
+    def _add_pending(self, answer, points):
+        # runs with the lock held
+        self._pending_answers[answer] = points
+        if points:
+            player = answer[0]
+            self._pending[player] = self._pending.get(player, 0) + points
+
+    @staticmethod
+    def _answered(player, question_id):
+        # read on the primary, as the last batch may not have reached the
+        # replicas yet
+        with primary():
+            return db.session.query(Answer.player).filter(
+                Answer.player == player,
+                Answer.question_id == question_id).first() is not None
+
+    def record(self, player, question_id, points):
+        """
+        records the answer of a player to a question and adds its points,
+        none for a wrong answer, to the score of the player, unless the
+        player answered that question before. tells whether it was the
+        first answer
+        """
+        answer = (player, question_id)
+        with self._lock:
+            self._load()
+            if self._held(answer):
+                return False
+        if self._answered(player, question_id):
+            return False
+        with self._lock:
+            if self._held(answer):
+                return False
+            if points:
+                self.store.incr(player, points)
+            self._add_pending(answer, points)
+            due = (len(self._pending) >= self.flush_size or
+                   time.monotonic() >= self._flushed_at + self.flush_seconds)
+            if not due:
+                self._schedule_flush()
+        if due:
+            self.flush()
+        return True
+
+    def standing(self, player):
+        """
+        returns the (rank, score) of a player, ranks starting at 1, or
+        None for a player without points
+        """
+        with self._lock:
+            self._load()
+        score = self.store.score(player)
+        if score is None:
+            return None
+        return self.store.rank(player) + 1, score
+
+    def top(self, count):
+        with self._lock:
+            self._load()
+        return self.store.top(count)
+
+    def players(self):
+        with self._lock:
+            self._load()
+        return len(self.store)
+
+    def flush(self):
+        with self._lock:
+            answers, self._pending_answers = self._pending_answers, {}
+            self._pending = {}
+            self._writing.update(answers)
+            self._flushed_at = time.monotonic()
+        if not answers:
+            return
+        try:
+            with primary():
+                repeated = write_scores(answers)
+                db.session.commit()
+        except SQLAlchemyError:
+            db.session.rollback()
+            current_app.logger.exception(
+                'Could not write a batch of %d answers', len(answers))
+            with self._lock:
+                for answer, points in answers.items():
+                    self._writing.pop(answer, None)
+                    self._add_pending(answer, points)
+                self._schedule_flush()
+            return
+        with self._lock:
+            for answer in answers:
+                self._writing.pop(answer, None)
+            # another worker wrote these answers first, with their points
+            for player, points in repeated.items():
+                self.store.incr(player, -points)
+        self.flushes += 1
+
+    def on_scores_change(self, action, score):
+        # the scores table was written without the leaderboard
+        with self._lock:
+            self._pending = {}
+            self._pending_answers = {}
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            self.store.clear()
+            self._loaded = False
+
+    def stats(self):
+        return {
+            'pending': len(self._pending),
+            'flushes': self.flushes,
+        }
+
+
+leaderboard = Leaderboard()
+on_change('scores', leaderboard.on_scores_change)
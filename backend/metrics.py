@@ -0,0 +1,215 @@
+import bisect
+import threading
+
+"""
+Prometheus metrics
+
+Counters and histograms are written without locks: every thread updates
+its own shard of values and the shards are only added up when /metrics
+is scraped, so recording a request costs a few dictionary operations.
+Gauges, and counters kept by other modules, are read by a callback at
+scrape time.
+"""
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# request durations, in seconds
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+                   10.0)
+
+
+class _ThreadShards:
+
+    # shards are keyed by thread identifier: a finished thread's id is
+    # given to a later thread, which carries on with its shard, so there
+    # are never many more shards than threads running at once, even with
+    # a thread per request
+    def __init__(self):
+        self._shards = {}
+
+    def mine(self):
+        ident = threading.get_ident()
+        shard = self._shards.get(ident)
+        if shard is None:
+            shard = self._shards.setdefault(ident, {})
+        return shard
+
+    def all(self):
+        # dict() copies a shard atomically while its thread keeps writing
+        return [dict(shard) for shard in list(self._shards.values())]
+
+
+def _format_labels(names, values):
+    if not names:
+        return ''
+    return '{' + ','.join(
+        '{}="{}"'.format(name, str(value).replace('\\', '\\\\').
+                         replace('"', '\\"').replace('\n', '\\n'))
+        for name, value in zip(names, values)) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._shards = _ThreadShards()
+
+    def inc(self, labels=(), amount=1):
+        shard = self._shards.mine()
+        shard[labels] = shard.get(labels, 0) + amount
+
+    def values(self):
+        totals = {}
+        for shard in self._shards.all():
+            for labels, value in shard.items():
+                totals[labels] = totals.get(labels, 0) + value
+        return totals
+
+    def render(self):
+        lines = ['# HELP {} {}'.format(self.name, self.documentation),
+                 '# TYPE {} counter'.format(self.name)]
+        for labels, value in sorted(self.values().items()):
+            lines.append('{}{} {}'.format(
+                self.name, _format_labels(self.labelnames, labels),
+                _format_value(value)))
+        return lines
+
+
+class Histogram:
+
+    def __init__(self, name, documentation, labelnames=(),
+                 buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._shards = _ThreadShards()
+
+    def observe(self, value, labels=()):
+        shard = self._shards.mine()
+        entry = shard.get(labels)
+        if entry is None:
+            # one count per bucket and +Inf, then the sum
+            entry = shard[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        entry[bisect.bisect_left(self.buckets, value)] += 1
+        entry[-1] += value
+
+    def render(self):
+        totals = {}
+        for shard in self._shards.all():
+            for labels, entry in shard.items():
+                total = totals.setdefault(labels, [0] * len(entry))
+                for i, value in enumerate(entry):
+                    total[i] += value
+
+        lines = ['# HELP {} {}'.format(self.name, self.documentation),
+                 '# TYPE {} histogram'.format(self.name)]
+        names = self.labelnames + ('le',)
+        for labels, entry in sorted(totals.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),),
+                                    entry[:-1]):
+                cumulative += count
+                lines.append('{}_bucket{} {}'.format(
+                    self.name,
+                    _format_labels(names, labels + (_format_value(bound),)),
+                    cumulative))
+            label_text = _format_labels(self.labelnames, labels)
+            lines.append('{}_sum{} {}'.format(
+                self.name, label_text, _format_value(entry[-1])))
+            lines.append('{}_count{} {}'.format(
+                self.name, label_text, cumulative))
+        return lines
+
+
+class CallbackMetric:
+
+    def __init__(self, name, documentation, kind, labelnames, collect):
+        # collect() returns a list of (label values, value)
+        self.name = name
+        self.documentation = documentation
+        self.kind = kind
+        self.labelnames = tuple(labelnames)
+        self.collect = collect
+
+    def render(self):
+        lines = ['# HELP {} {}'.format(self.name, self.documentation),
+                 '# TYPE {} {}'.format(self.name, self.kind)]
+        for labels, value in self.collect():
+            lines.append('{}{} {}'.format(
+                self.name, _format_labels(self.labelnames, labels),
+                _format_value(value)))
+        return lines
+
+
+class Registry:
+
+    def __init__(self):
+        self._metrics = {}
+
+    def register(self, metric):
+        # registering a name again replaces the metric, so that apps
+        # created again (as in tests) don't report twice
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self.register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(),
+                  buckets=DEFAULT_BUCKETS):
+        return self.register(
+            Histogram(name, documentation, labelnames, buckets))
+
+    def gauge(self, name, documentation, labelnames, collect):
+        # a gauge whose values are read by collect() at scrape time
+        return self.register(CallbackMetric(
+            name, documentation, 'gauge', labelnames, collect))
+
+    def callback_counter(self, name, documentation, labelnames, collect):
+        # a counter kept elsewhere, read by collect() at scrape time
+        return self.register(CallbackMetric(
+            name, documentation, 'counter', labelnames, collect))
+
+    def render(self):
+        lines = []
+        for metric in list(self._metrics.values()):
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+requests_total = registry.counter(
+    'trivia_http_requests_total', 'HTTP requests served.',
+    ('route', 'method', 'status'))
+request_duration = registry.histogram(
+    'trivia_http_request_duration_seconds', 'Time spent serving requests.',
+    ('route', 'method'))
+db_queries_total = registry.counter(
+    'trivia_db_queries_total', 'Database queries run by requests.',
+    ('route',))
+errors_total = registry.counter(
+    'trivia_http_errors_total', 'Responses sent by the error handlers.',
+    ('status',))
+
+
+"""
+record_request(route, method, status, duration, query_count)
+    counts a served request
+"""
+
+
+def record_request(route, method, status, duration, query_count):
+    requests_total.inc((route, method, str(status)))
+    request_duration.observe(duration, (route, method))
+    if query_count:
+        db_queries_total.inc((route,), query_count)
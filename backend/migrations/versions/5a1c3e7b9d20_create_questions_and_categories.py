@@ -0,0 +1,41 @@
+"""create questions and categories
+
+Revision ID: 5a1c3e7b9d20
+Revises: 
+Create Date: 2026-10-18 09:12:41.532018
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5a1c3e7b9d20'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # the schema of trivia.psql. databases restored from it should be
+    # marked as migrated with `flask db stamp 5a1c3e7b9d20` instead
+    op.create_table(
+        'categories',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('type', sa.String(), nullable=True),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_table(
+        'questions',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('question', sa.String(), nullable=True),
+        sa.Column('answer', sa.String(), nullable=True),
+        sa.Column('category', sa.Integer(), nullable=True),
+        sa.Column('difficulty', sa.Integer(), nullable=True),
+        sa.PrimaryKeyConstraint('id')
+    )
+
+
+def downgrade():
+    op.drop_table('questions')
+    op.drop_table('categories')
@@ -0,0 +1,49 @@
+"""add question indexes and constraints
+
+Revision ID: 9e4f2b6c1a37
+Revises: 5a1c3e7b9d20
+Create Date: 2026-10-18 09:27:05.118634
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9e4f2b6c1a37'
+down_revision = '5a1c3e7b9d20'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_questions_category', 'questions', ['category'])
+    op.create_index('ix_questions_category_difficulty', 'questions',
+                    ['category', 'difficulty'])
+    op.create_index('ix_categories_type', 'categories', ['type'],
+                    unique=True)
+    with op.batch_alter_table('questions') as batch_op:
+        batch_op.create_foreign_key('questions_category_fkey', 'categories',
+                                    ['category'], ['id'])
+
+    # the trigram index backing searches, when the server has pg_trgm
+    bind = op.get_bind()
+    if bind.dialect.name == 'postgresql' and bind.execute(sa.text(
+            "SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm'"
+    )).scalar():
+        op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+        op.execute('CREATE INDEX IF NOT EXISTS ix_questions_question_trgm '
+                   'ON questions USING gin (question gin_trgm_ops)')
+
+
+def downgrade():
+    bind = op.get_bind()
+    if bind.dialect.name == 'postgresql':
+        op.execute('DROP INDEX IF EXISTS ix_questions_question_trgm')
+
+    with op.batch_alter_table('questions') as batch_op:
+        batch_op.drop_constraint('questions_category_fkey',
+                                 type_='foreignkey')
+    op.drop_index('ix_categories_type', table_name='categories')
+    op.drop_index('ix_questions_category_difficulty', table_name='questions')
+    op.drop_index('ix_questions_category', table_name='questions')
@@ -0,0 +1,29 @@
+"""create scores
+
+Revision ID: c3d8a1f5e642
+Revises: 9e4f2b6c1a37
+Create Date: 2026-10-18 14:03:52.207415
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c3d8a1f5e642'
+down_revision = '9e4f2b6c1a37'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'scores',
+        sa.Column('player', sa.String(length=64), nullable=False),
+        sa.Column('score', sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint('player')
+    )
+
+
+def downgrade():
+    op.drop_table('scores')
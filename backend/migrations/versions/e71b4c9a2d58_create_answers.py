@@ -0,0 +1,31 @@
+"""create answers
+
+Revision ID: e71b4c9a2d58
+Revises: c3d8a1f5e642
+Create Date: 2026-10-18 17:41:09.583102
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e71b4c9a2d58'
+down_revision = 'c3d8a1f5e642'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # no foreign key to questions: deleting a question keeps the points
+    # it earned
+    op.create_table(
+        'answers',
+        sa.Column('player', sa.String(length=64), nullable=False),
+        sa.Column('question_id', sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint('player', 'question_id')
+    )
+
+
+def downgrade():
+    op.drop_table('answers')
@@ -1,6 +1,10 @@
 import os
-from sqlalchemy import Column, String, Integer, create_engine
-from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import Column, String, Integer, ForeignKey, Index, \
+    create_engine, event
+from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.pool import NullPool
+from flask import g, has_app_context
+from flask_sqlalchemy import SQLAlchemy, SignallingSession
 import json
 
 DB_USERNAME = os.getenv('DB_USER', 'postgres')
@@ -15,20 +19,188 @@ database_path = 'postgresql://{}:{}@{}/{}'.format(
     DB_NAME
 )
 
-db = SQLAlchemy()
+
+def _env_flag(name, default):
+    return os.getenv(name, default).lower() in ('1', 'true', 'yes', 'on')
+
+
+# connection pool settings, overridable in the app config under the same
+# names. DB_STATEMENT_TIMEOUT is in milliseconds, 0 meaning no timeout
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', 5))
+DB_MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW', 10))
+DB_POOL_TIMEOUT = int(os.getenv('DB_POOL_TIMEOUT', 30))
+DB_POOL_RECYCLE = int(os.getenv('DB_POOL_RECYCLE', 1800))
+DB_POOL_PRE_PING = _env_flag('DB_POOL_PRE_PING', 'true')
+DB_STATEMENT_TIMEOUT = int(os.getenv('DB_STATEMENT_TIMEOUT', 0))
+DB_PGBOUNCER = _env_flag('DB_PGBOUNCER', 'false')
+
+# comma separated URIs of read replicas of the database
+DB_REPLICA_URIS = [
+    uri for uri in os.getenv('DB_REPLICA_URIS', '').split(',') if uri]
+
+"""
+engine_options(config, database_path)
+    returns the create_engine options for the connection pool described
+    by the DB_* settings of config. in PgBouncer mode the app keeps no
+    connections of its own (NullPool) and sends no startup options, which
+    PgBouncer rejects; psycopg2 never uses server-side prepared
+    statements, so transaction pooling is safe
+"""
+
+
+def engine_options(config, database_path):
+    if database_path.startswith('sqlite'):
+        # Flask-SQLAlchemy picks the right pool for SQLite
+        return {}
+
+    options = {}
+    if config['DB_PGBOUNCER']:
+        options['poolclass'] = NullPool
+    else:
+        options['pool_size'] = config['DB_POOL_SIZE']
+        options['max_overflow'] = config['DB_MAX_OVERFLOW']
+        options['pool_timeout'] = config['DB_POOL_TIMEOUT']
+        options['pool_recycle'] = config['DB_POOL_RECYCLE']
+        options['pool_pre_ping'] = config['DB_POOL_PRE_PING']
+
+        if (config['DB_STATEMENT_TIMEOUT'] and
+                database_path.startswith('postgresql')):
+            options['connect_args'] = {
+                'options': '-c statement_timeout={:d}'.format(
+                    config['DB_STATEMENT_TIMEOUT'])}
+    return options
+
+
+"""
+replica_binds(config)
+    the bind names of the read replicas listed in config
+"""
+
+
+def replica_binds(config):
+    return ['replica_{}'.format(i)
+            for i in range(len(config.get('DB_REPLICA_URIS', ())))]
+
+
+"""
+current_replica()
+    the bind of the replica the current request reads from,
+    None when it reads from the primary
+"""
+
+
+def current_replica():
+    return g.get('db_replica') if has_app_context() else None
+
+
+"""
+RoutingSession
+    a session that runs every statement of a request on the replica
+    chosen for it, if any, except for flushes, which write
+"""
+
+
+class RoutingSession(SignallingSession):
+
+    def get_bind(self, mapper=None, clause=None):
+        replica = current_replica()
+        if replica is not None and not self._flushing:
+            return db.get_engine(self.app, bind=replica)
+        return SignallingSession.get_bind(self, mapper, clause)
+
+
+"""
+RoutingSQLAlchemy
+    creates its engines with the pool of engine_options, for the
+    primary and the replicas alike, and its sessions as RoutingSession
+"""
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+
+    def apply_driver_hacks(self, app, sa_url, options):
+        options.update(engine_options(app.config, str(sa_url)))
+        return SQLAlchemy.apply_driver_hacks(self, app, sa_url, options)
+
+    def create_session(self, options):
+        return sessionmaker(class_=RoutingSession, db=self, **options)
+
+
+db = RoutingSQLAlchemy()
+
 
 """
 setup_db(app)
-    binds a flask application and a SQLAlchemy service
+    binds a flask application and a SQLAlchemy service, and the read
+    replicas as binds named by replica_binds. nothing is sent to the
+    database until it is first used: the schema is created by the
+    migrations, with flask init-db
 """
 
 
 def setup_db(app, database_path=database_path):
     app.config["SQLALCHEMY_DATABASE_URI"] = database_path
     app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    for name, value in (('DB_POOL_SIZE', DB_POOL_SIZE),
+                        ('DB_MAX_OVERFLOW', DB_MAX_OVERFLOW),
+                        ('DB_POOL_TIMEOUT', DB_POOL_TIMEOUT),
+                        ('DB_POOL_RECYCLE', DB_POOL_RECYCLE),
+                        ('DB_POOL_PRE_PING', DB_POOL_PRE_PING),
+                        ('DB_STATEMENT_TIMEOUT', DB_STATEMENT_TIMEOUT),
+                        ('DB_PGBOUNCER', DB_PGBOUNCER),
+                        ('DB_REPLICA_URIS', DB_REPLICA_URIS)):
+        app.config.setdefault(name, value)
+    binds = dict(app.config.get("SQLALCHEMY_BINDS") or {})
+    binds.update(zip(replica_binds(app.config),
+                     app.config['DB_REPLICA_URIS']))
+    app.config["SQLALCHEMY_BINDS"] = binds
     db.app = app
     db.init_app(app)
-    db.create_all()
+
+
+"""
+pool_stats(engine=None)
+    describes the connection pool of an engine, the default one
+    when none is given: its class, size and how many connections are
+    idle, in use and opened beyond the size. a NullPool keeps none
+"""
+
+
+def pool_stats(engine=None):
+    pool = (engine or db.engine).pool
+    stats = {'pool': type(pool).__name__}
+    for name in ('size', 'checkedin', 'checkedout', 'overflow'):
+        method = getattr(pool, name, None)
+        if method is not None:
+            stats[name] = method()
+    return stats
+
+
+"""
+on_change(tablename, callback)
+    registers a callback that runs after rows of a table are written
+    through the model helpers. the callback receives the action
+    ('insert', 'update', 'delete' or 'bulk') and the affected instance,
+    which is None for bulk changes
+"""
+
+_change_listeners = {}
+
+
+def on_change(tablename, callback):
+    _change_listeners.setdefault(tablename, []).append(callback)
+
+
+def notify_change(tablename, action, instance=None):
+    for callback in _change_listeners.get(tablename, ()):
+        callback(action, instance)
+
+
+@event.listens_for(Session, 'after_bulk_delete')
+@event.listens_for(Session, 'after_bulk_update')
+def _notify_bulk_change(context):
+    # query(...).delete() and query(...).update() bypass the model helpers
+    notify_change(context.mapper.local_table.name, 'bulk')
 
 
 """
@@ -39,11 +211,14 @@ Question
 
 class Question(db.Model):
     __tablename__ = 'questions'
+    __table_args__ = (
+        Index('ix_questions_category_difficulty', 'category', 'difficulty'),
+    )
 
     id = Column(Integer, primary_key=True)
     question = Column(String)
     answer = Column(String)
-    category = Column(Integer)
+    category = Column(Integer, ForeignKey('categories.id'), index=True)
     difficulty = Column(Integer)
 
     def __init__(self, question, answer, category, difficulty):
@@ -55,23 +230,46 @@ class Question(db.Model):
     def insert(self):
         db.session.add(self)
         db.session.commit()
+        notify_change(self.__tablename__, 'insert', self)
 
     def update(self):
         db.session.commit()
+        notify_change(self.__tablename__, 'update', self)
 
     def delete(self):
         db.session.delete(self)
         db.session.commit()
+        notify_change(self.__tablename__, 'delete', self)
 
-    def format(self):
+    # the ids of the questions of a category, or of all questions when
+    # category_id is 0, read as plain values without loading the questions
+    @classmethod
+    def ids_in_category(cls, category_id):
+        query = db.session.query(cls.id)
+        if category_id != 0:
+            query = query.filter(cls.category == category_id)
+        return [question_id for question_id, in query]
+
+    # the columns read by format, to query rows instead of objects
+    @classmethod
+    def format_columns(cls):
+        return (cls.id, cls.question, cls.answer, cls.category,
+                cls.difficulty)
+
+    # formats a question, or a row of the format_columns
+    @staticmethod
+    def format_row(row):
         return {
-            'id': self.id,
-            'question': self.question,
-            'answer': self.answer,
-            'category': self.category,
-            'difficulty': self.difficulty,
+            'id': row.id,
+            'question': row.question,
+            'answer': row.answer,
+            'category': row.category,
+            'difficulty': row.difficulty,
         }
 
+    def format(self):
+        return self.format_row(self)
+
 
 """
 Category
@@ -83,7 +281,7 @@ class Category(db.Model):
     __tablename__ = 'categories'
 
     id = Column(Integer, primary_key=True)
-    type = Column(String)
+    type = Column(String, unique=True, index=True)
 
     def __init__(self, type):
         self.type = type
@@ -91,9 +289,59 @@ class Category(db.Model):
     def insert(self):
         db.session.add(self)
         db.session.commit()
+        notify_change(self.__tablename__, 'insert', self)
+
+    def update(self):
+        db.session.commit()
+        notify_change(self.__tablename__, 'update', self)
+
+    def delete(self):
+        db.session.delete(self)
+        db.session.commit()
+        notify_change(self.__tablename__, 'delete', self)
+
+    # every category as an {id: type} map, read without loading objects
+    @classmethod
+    def id_type_map(cls):
+        return dict(db.session.query(cls.id, cls.type))
 
     def format(self):
         return {
             'id': self.id,
             'type': self.type
         }
+
+
+"""
+Score
+    the points of a player, written in batches by the leaderboard
+
+"""
+
+
+class Score(db.Model):
+    __tablename__ = 'scores'
+
+    player = Column(String(64), primary_key=True)
+    score = Column(Integer, nullable=False, default=0)
+
+    def format(self):
+        return {
+            'player': self.player,
+            'score': self.score
+        }
+
+
+"""
+Answer
+    a question a player answered, so that only their first answer to it
+    can score
+
+"""
+
+
+class Answer(db.Model):
+    __tablename__ = 'answers'
+
+    player = Column(String(64), primary_key=True)
+    question_id = Column(Integer, primary_key=True)
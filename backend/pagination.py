@@ -0,0 +1,95 @@
+import os
+import time
+
+from sqlalchemy import func
+
+from models import on_change
+from replicas import primary
+
+COUNT_CACHE_TTL = float(os.getenv('COUNT_CACHE_TTL', 30))
+
+"""
+CountCache
+    remembers the result of COUNT(*) queries so that listing endpoints
+    don't count the whole table on every page request. entries expire
+    after `ttl` seconds, which also bounds how long a count written by
+    another worker process can stay stale
+"""
+
+
+class CountCache:
+
+    def __init__(self, ttl=COUNT_CACHE_TTL):
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = {}
+
+    def get(self, key, compute):
+        now = time.monotonic()
+        entry = self._entries.get(key)
+        if entry is not None and now - entry[1] < self.ttl:
+            self.hits += 1
+            return entry[0]
+        self.misses += 1
+        value = compute()
+        self._entries[key] = (value, now)
+        return value
+
+    def invalidate(self, *args):
+        self._entries.clear()
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'size': len(self._entries),
+        }
+
+
+count_cache = CountCache()
+on_change('questions', count_cache.invalidate)
+
+
+"""
+count_rows(query, column, key)
+    returns the number of rows matched by query, counted on column and
+    served from the count cache under key when possible
+"""
+
+
+def count_rows(query, column, key):
+    def count():
+        with primary():
+            return query.order_by(None).\
+                with_entities(func.count(column)).scalar()
+    return count_cache.get(key, count)
+
+
+"""
+paginate(query, column, page, per_page)
+    returns the rows of the given 1-based page, ordered by column,
+    using LIMIT/OFFSET in the database
+"""
+
+
+def paginate(query, column, page, per_page):
+    return query.order_by(column).\
+        offset((page - 1) * per_page).\
+        limit(per_page).\
+        all()
+
+
+"""
+paginate_after(query, column, after, per_page)
+    keyset pagination: returns up to per_page rows whose column value is
+    greater than after. unlike OFFSET, the cost does not grow with how
+    deep into the result set the client is
+"""
+
+
+def paginate_after(query, column, after, per_page):
+    return query.filter(column > after).\
+        order_by(column).\
+        limit(per_page).\
+        all()
@@ -0,0 +1,250 @@
+import csv
+import io
+import json
+import os
+
+from sqlalchemy.exc import SQLAlchemyError
+
+from models import db, Question, notify_change
+from category_cache import category_cache
+
+IMPORT_BATCH_SIZE = int(os.getenv('IMPORT_BATCH_SIZE', 1000))
+EXPORT_BATCH_SIZE = int(os.getenv('EXPORT_BATCH_SIZE', 1000))
+
+# most row errors listed in an import report
+MAX_REPORTED_ERRORS = 1000
+
+QUESTION_FIELDS = ('question', 'answer', 'category', 'difficulty')
+EXPORT_FIELDS = ('id',) + QUESTION_FIELDS
+
+
+"""
+InvalidQuestion
+    raised when the data of a question breaks one of the rules checked
+    by validate_question. status is the HTTP status to answer with
+"""
+
+
+class InvalidQuestion(Exception):
+
+    def __init__(self, message, status=422):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+
+
+"""
+validate_question(data)
+    checks the data of a new question and returns it as a mapping of
+    the question columns, or raises InvalidQuestion
+"""
+
+
+def validate_question(data):
+    for field in QUESTION_FIELDS:
+        if field not in data:
+            raise InvalidQuestion('Missing ' + field)
+
+    if data['category'] is None or data['category'] == '':
+        raise InvalidQuestion('No category found', 404)
+
+    if not data['question']:
+        raise InvalidQuestion('Missing question text')
+
+    if not data['answer']:
+        raise InvalidQuestion('Missing answer text')
+
+    try:
+        category = int(data['category'])
+    except (TypeError, ValueError):
+        raise InvalidQuestion('Invalid category')
+
+    if not category_cache.exists(category):
+        raise InvalidQuestion('No category found', 404)
+
+    difficulty = data['difficulty']
+    if difficulty is not None and difficulty != '':
+        try:
+            difficulty = int(difficulty)
+        except (TypeError, ValueError):
+            raise InvalidQuestion('Invalid difficulty')
+    else:
+        difficulty = None
+
+    return {
+        'question': data['question'],
+        'answer': data['answer'],
+        'category': category,
+        'difficulty': difficulty,
+    }
+
+
+"""
+read_jsonl(lines) / read_csv(lines)
+    parse question rows from an iterable of text lines, yielding
+    (line number, data, error) where exactly one of data and error is set.
+    csv input needs a header naming the question columns
+"""
+
+
+def read_jsonl(lines):
+    for line_number, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            data = json.loads(line)
+        except ValueError:
+            yield line_number, None, 'Invalid JSON'
+            continue
+        if not isinstance(data, dict):
+            yield line_number, None, 'Expected a JSON object'
+            continue
+        yield line_number, data, None
+
+
+def read_csv(lines):
+    reader = csv.DictReader(lines)
+    for data in reader:
+        yield reader.line_num, data, None
+
+
+READERS = {
+    'jsonl': read_jsonl,
+    'csv': read_csv,
+}
+
+
+"""
+ImportReport
+    the outcome of an import: how many rows were written
+    and why the other rows were rejected
+"""
+
+
+class ImportReport:
+
+    def __init__(self):
+        self.imported = 0
+        self.error_count = 0
+        self.errors = []
+
+    def add_error(self, line_number, message):
+        self.error_count += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({'line': line_number, 'message': message})
+
+    def format(self):
+        return {
+            'imported': self.imported,
+            'error_count': self.error_count,
+            'errors': self.errors,
+        }
+
+
+def _write_batch(batch, report):
+    try:
+        db.session.bulk_insert_mappings(
+            Question, [mapping for _, mapping in batch])
+        db.session.commit()
+        report.imported += len(batch)
+        return
+    except SQLAlchemyError:
+        db.session.rollback()
+
+    # find the rows the database rejected by writing them one by one
+    for line_number, mapping in batch:
+        try:
+            db.session.bulk_insert_mappings(Question, [mapping])
+            db.session.commit()
+            report.imported += 1
+        except SQLAlchemyError:
+            db.session.rollback()
+            report.add_error(line_number, 'Could not be saved')
+
+
+"""
+import_questions(rows, batch_size)
+    validates the parsed rows and writes the valid ones in batches of
+    batch_size with one bulk insert per batch. invalid rows are reported
+    and skipped without stopping the import
+"""
+
+
+def import_questions(rows, batch_size=IMPORT_BATCH_SIZE):
+    report = ImportReport()
+    batch = []
+    for line_number, data, error in rows:
+        if error is None:
+            try:
+                batch.append((line_number, validate_question(data)))
+            except InvalidQuestion as invalid:
+                error = invalid.message
+        if error is not None:
+            report.add_error(line_number, error)
+            continue
+        if len(batch) >= batch_size:
+            _write_batch(batch, report)
+            batch = []
+    if batch:
+        _write_batch(batch, report)
+
+    # bulk inserts bypass Question.insert
+    if report.imported:
+        notify_change(Question.__tablename__, 'bulk')
+    return report
+
+
+"""
+iter_export_rows(category_id, batch_size)
+    yields (id, question, answer, category, difficulty) tuples of every
+    question, or of the questions of a category, in id order. rows are
+    read from a server-side cursor batch_size at a time, so the whole
+    table is never held in memory
+"""
+
+
+def iter_export_rows(category_id=None, batch_size=EXPORT_BATCH_SIZE):
+    query = db.session.query(
+        Question.id, Question.question, Question.answer,
+        Question.category, Question.difficulty)
+    if category_id is not None:
+        query = query.filter(Question.category == category_id)
+    return query.order_by(Question.id).\
+        execution_options(stream_results=True).\
+        yield_per(batch_size)
+
+
+"""
+write_jsonl(rows) / write_csv(rows)
+    turn exported rows into lines of text, the csv lines
+    starting with a header that read_csv understands
+"""
+
+
+def write_jsonl(rows):
+    for row in rows:
+        yield json.dumps(dict(zip(EXPORT_FIELDS, row))) + '\n'
+
+
+def write_csv(rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_FIELDS)
+    for row in rows:
+        writer.writerow(row)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue()
+
+
+WRITERS = {
+    'jsonl': write_jsonl,
+    'csv': write_csv,
+}
+
+EXPORT_MIMETYPES = {
+    'jsonl': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
@@ -0,0 +1,275 @@
+import threading
+
+from sqlalchemy import event, func, text
+
+from models import db, Question, on_change
+from replicas import primary
+
+"""
+Question search
+
+On PostgreSQL, searches run in the database as an ILIKE over
+questions.question, which a pg_trgm GIN index turns into an index scan,
+and results are ranked by trigram similarity to the search term. The
+index is maintained by PostgreSQL itself on every insert and delete.
+
+Other databases (SQLite test runs) use an in-memory trigram inverted
+index of the question texts instead. It is built on the first search
+and kept in sync by Question.insert/update/delete.
+"""
+
+TRIGRAM_INDEX_NAME = 'ix_questions_question_trgm'
+
+# number of rows fetched per round trip when streaming results
+SEARCH_BATCH_SIZE = 500
+
+
+"""
+install_trigram_index(connection)
+    creates the pg_trgm extension and the GIN index backing searches,
+    when the extension is available on the server. returns whether
+    the index exists
+"""
+
+
+def install_trigram_index(connection):
+    available = connection.execute(text(
+        "SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm'"
+    )).scalar()
+    if not available:
+        return False
+    connection.execute(text('CREATE EXTENSION IF NOT EXISTS pg_trgm'))
+    connection.execute(text(
+        'CREATE INDEX IF NOT EXISTS {} ON questions '
+        'USING gin (question gin_trgm_ops)'.format(TRIGRAM_INDEX_NAME)))
+    return True
+
+
+@event.listens_for(Question.__table__, 'after_create')
+def _create_trigram_index(table, connection, **kw):
+    if connection.dialect.name == 'postgresql':
+        install_trigram_index(connection)
+
+
+# whether pg_trgm is installed, per database url
+_trigram_support = {}
+
+
+def _has_trigram_support(engine):
+    key = str(engine.url)
+    if key not in _trigram_support:
+        _trigram_support[key] = bool(engine.execute(text(
+            "SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'"
+        )).scalar())
+    return _trigram_support[key]
+
+
+def escape_like(term):
+    return term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def trigrams(value):
+    return {value[i:i + 3] for i in range(len(value) - 2)}
+
+
+"""
+TrigramIndex
+    an inverted index from the trigrams of the lower-cased question texts
+    to question ids. a term matches a question when it is a substring of
+    its text, exactly like ILIKE '%term%'; the trigrams only narrow down
+    which texts need to be checked
+"""
+
+
+class TrigramIndex:
+
+    def __init__(self):
+        self.loaded = False
+        self._texts = {}
+        self._postings = {}
+        self._lock = threading.RLock()
+
+    def load(self, rows):
+        with self._lock:
+            self.clear()
+            for question_id, question_text in rows:
+                self.add(question_id, question_text)
+            self.loaded = True
+
+    def clear(self):
+        with self._lock:
+            self.loaded = False
+            self._texts = {}
+            self._postings = {}
+
+    def add(self, question_id, question_text):
+        with self._lock:
+            self.remove(question_id)
+            value = (question_text or '').lower()
+            self._texts[question_id] = value
+            for trigram in trigrams(value):
+                self._postings.setdefault(trigram, set()).add(question_id)
+
+    def remove(self, question_id):
+        with self._lock:
+            value = self._texts.pop(question_id, None)
+            if value is None:
+                return
+            for trigram in trigrams(value):
+                postings = self._postings.get(trigram)
+                if postings is not None:
+                    postings.discard(question_id)
+                    if not postings:
+                        del self._postings[trigram]
+
+    def search(self, term):
+        # returns the ids of the matching questions, best match first
+        term = term.lower()
+        term_trigrams = trigrams(term)
+        with self._lock:
+            if term_trigrams:
+                postings = sorted(
+                    (self._postings.get(trigram, ()) for trigram in
+                     term_trigrams), key=len)
+                candidates = set(postings[0]).intersection(*postings[1:])
+            else:
+                candidates = self._texts.keys()
+            matches = [
+                (question_id, self._texts[question_id])
+                for question_id in candidates
+                if term in self._texts[question_id]]
+
+        # rank like pg_trgm similarity: shared over distinct trigrams
+        def similarity(match):
+            text_trigrams = len(trigrams(match[1]))
+            shared = len(term_trigrams)
+            return shared / max(text_trigrams + len(term_trigrams) - shared, 1)
+
+        matches.sort(key=lambda match: (-similarity(match), match[0]))
+        return [question_id for question_id, _ in matches]
+
+
+search_index = TrigramIndex()
+
+
+def _sync_search_index(action, question):
+    if not search_index.loaded:
+        return
+    if action in ('insert', 'update'):
+        search_index.add(question.id, question.question)
+    elif action == 'delete':
+        search_index.remove(question.id)
+    else:
+        search_index.clear()
+
+
+on_change('questions', _sync_search_index)
+
+
+def uses_database_search():
+    return db.engine.dialect.name == 'postgresql'
+
+
+"""
+database_search_query(term)
+    returns a query of the questions whose text contains term,
+    ranked best match first
+"""
+
+
+def database_search_query(term):
+    query = Question.query.filter(
+        Question.question.ilike('%' + escape_like(term) + '%', escape='\\'))
+    if _has_trigram_support(db.engine):
+        rank = func.similarity(Question.question, term).desc()
+    else:
+        rank = func.strpos(func.lower(Question.question), term.lower())
+    return query.order_by(rank, Question.id)
+
+
+"""
+indexed_search_ids(term)
+    returns the ids of the questions whose text contains term, ranked
+    best match first, from the in-memory index
+"""
+
+
+def indexed_search_ids(term):
+    if not search_index.loaded:
+        with primary():
+            search_index.load(
+                db.session.query(Question.id, Question.question))
+    return search_index.search(term)
+
+
+def _questions_by_ids(ids):
+    # loads the questions of ids, keeping the order of ids
+    if not ids:
+        return []
+    questions = {
+        question.id: question
+        for question in Question.query.filter(Question.id.in_(ids))}
+    return [questions[i] for i in ids if i in questions]
+
+
+"""
+find_questions(term, page=1, limit=None)
+    returns the given page of the questions whose text contains term,
+    best match first, and the total number of matching questions
+"""
+
+
+def find_questions(term, page=1, limit=None):
+    offset = (page - 1) * limit if limit else 0
+
+    if uses_database_search():
+        query = database_search_query(term)
+        if limit is None:
+            questions = query.all()
+            return questions, len(questions)
+        questions = query.offset(offset).limit(limit).all()
+        if page == 1 and len(questions) < limit:
+            return questions, len(questions)
+        total = query.order_by(None).\
+            with_entities(func.count(Question.id)).scalar()
+        return questions, total
+
+    ids = indexed_search_ids(term)
+    page_ids = ids[offset:offset + limit] if limit else ids
+    return _questions_by_ids(page_ids), len(ids)
+
+
+"""
+iter_questions(term, batch_size)
+    yields every question whose text contains term, best match first,
+    holding at most batch_size questions in memory at a time
+"""
+
+
+def iter_questions(term, batch_size=SEARCH_BATCH_SIZE):
+    if uses_database_search():
+        query = database_search_query(term).\
+            execution_options(stream_results=True).\
+            yield_per(batch_size)
+        for question in query:
+            yield question
+            # don't let the session keep every streamed question
+            db.session.expunge(question)
+        return
+
+    ids = indexed_search_ids(term)
+    for start in range(0, len(ids), batch_size):
+        questions = _questions_by_ids(ids[start:start + batch_size])
+        for question in questions:
+            yield question
+            db.session.expunge(question)
+
+
+"""
+categories_of(questions)
+    returns the distinct categories of questions, in order of appearance
+"""
+
+
+def categories_of(questions):
+    return list(dict.fromkeys(question.category for question in questions))
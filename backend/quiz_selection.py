@@ -0,0 +1,191 @@
+import os
+import random
+import threading
+import time
+from array import array
+
+from models import db, Question, on_change
+from replicas import primary
+
+QUESTION_POOLS_TTL = float(os.getenv('QUESTION_POOLS_TTL', 60))
+
+# random draws tried before listing the questions left, which only
+# happens once most questions of the pools were played
+MAX_DRAW_ATTEMPTS = 32
+
+"""
+questions_in_category(category_id)
+    returns a query over the questions of a category, or over
+    all questions when category_id is 0
+"""
+
+
+def questions_in_category(category_id):
+    query = Question.query
+    if category_id != 0:
+        query = query.filter(Question.category == category_id)
+    return query
+
+
+"""
+difficulty_bounds(data)
+    reads the difficulty filter of a quiz request, `difficulty` for one
+    level or `difficulty_range` for [lowest, highest], as a (lowest,
+    highest) pair, or None without a filter. raises ValueError when the
+    filter is malformed
+"""
+
+
+def difficulty_bounds(data):
+    difficulty = data.get('difficulty')
+    difficulty_range = data.get('difficulty_range')
+    if difficulty is not None and difficulty_range is not None:
+        raise ValueError('difficulty and difficulty_range are exclusive')
+    if difficulty is not None:
+        return int(difficulty), int(difficulty)
+    if difficulty_range is None:
+        return None
+    if isinstance(difficulty_range, (str, bytes)):
+        raise ValueError('difficulty_range must be a pair')
+    lowest, highest = (int(bound) for bound in difficulty_range)
+    if lowest > highest:
+        raise ValueError('difficulty_range is empty')
+    return lowest, highest
+
+
+"""
+previous_question_ids(data)
+    reads the ids of the questions already played, the
+    `previous_questions` list of a quiz request, as a set. raises
+    ValueError when it isn't a list of ids
+"""
+
+
+def previous_question_ids(data):
+    previous = data.get('previous_questions') or []
+    if not isinstance(previous, list):
+        raise ValueError('previous_questions must be a list')
+    return {int(question_id) for question_id in previous}
+
+
+"""
+QuestionPools
+    the ids of every question held in memory, in one pool per category
+    and difficulty, so that drawing a question takes a few lookups
+    instead of a query. the pools are read on first use with a single
+    query over three columns, then follow the questions inserted and
+    deleted through the models. other changes reload them, as does their
+    age reaching `ttl` seconds, which picks up the writes of other worker
+    processes
+"""
+
+
+class QuestionPools:
+
+    def __init__(self, ttl=QUESTION_POOLS_TTL):
+        self.ttl = ttl
+        self._pools = None
+        self._loaded_at = 0.0
+        self._lock = threading.Lock()
+
+    def _load(self):
+        pools = {}
+        with primary():
+            rows = db.session.query(
+                Question.id, Question.category, Question.difficulty)
+            for question_id, category, difficulty in rows:
+                pool = pools.get((category, difficulty))
+                if pool is None:
+                    pool = pools[(category, difficulty)] = array('q')
+                pool.append(question_id)
+        self._pools = pools
+        self._loaded_at = time.monotonic()
+        return pools
+
+    def _select(self, category_id, bounds):
+        # the pools of the category (every category with 0) whose
+        # difficulty is within bounds
+        pools = self._pools
+        if pools is None or time.monotonic() - self._loaded_at >= self.ttl:
+            pools = self._load()
+        return [pool for (category, difficulty), pool in pools.items()
+                if pool and
+                (category_id == 0 or category == category_id) and
+                (bounds is None or (difficulty is not None and
+                                    bounds[0] <= difficulty <= bounds[1]))]
+
+    def count(self, category_id, bounds=None):
+        with self._lock:
+            return sum(len(pool) for pool in self._select(category_id,
+                                                          bounds))
+
+    def draw(self, category_id, bounds=None, excluded=(), rng=random):
+        """
+        returns the id of a question drawn uniformly from the selected
+        pools and not in excluded, or None when none is left
+        """
+        with self._lock:
+            pools = self._select(category_id, bounds)
+            return self._draw(pools, excluded, rng)
+
+    def sample(self, category_id, count, bounds=None, excluded=(),
+               rng=random):
+        """
+        returns the ids of up to count distinct questions drawn from the
+        selected pools and not in excluded, fewer when fewer are left
+        """
+        with self._lock:
+            pools = self._select(category_id, bounds)
+            excluded = set(excluded)
+            drawn = []
+            while len(drawn) < count:
+                question_id = self._draw(pools, excluded, rng)
+                if question_id is None:
+                    break
+                drawn.append(question_id)
+                excluded.add(question_id)
+            return drawn
+
+    @staticmethod
+    def _draw(pools, excluded, rng):
+        total = sum(len(pool) for pool in pools)
+        if not total:
+            return None
+
+        # a position in the pools laid end to end, drawn again while it
+        # falls on an excluded question
+        for _ in range(MAX_DRAW_ATTEMPTS):
+            position = rng.randrange(total)
+            for pool in pools:
+                if position < len(pool):
+                    break
+                position -= len(pool)
+            if pool[position] not in excluded:
+                return pool[position]
+
+        left = [question_id for pool in pools for question_id in pool
+                if question_id not in excluded]
+        return rng.choice(left) if left else None
+
+    def on_question_change(self, action, question):
+        with self._lock:
+            if self._pools is None:
+                return
+            if action in ('insert', 'delete'):
+                pool = self._pools.setdefault(
+                    (question.category, question.difficulty), array('q'))
+                # the pools may have been read after the write committed
+                if action == 'insert' and question.id not in pool:
+                    pool.append(question.id)
+                elif action == 'delete' and question.id in pool:
+                    pool.remove(question.id)
+            else:
+                self._pools = None
+
+    def invalidate(self):
+        with self._lock:
+            self._pools = None
+
+
+question_pools = QuestionPools()
+on_change('questions', question_pools.on_question_change)
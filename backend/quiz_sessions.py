@@ -0,0 +1,153 @@
+import json
+import os
+import random
+import secrets
+import threading
+import time
+from array import array
+
+QUIZ_SESSION_TTL = int(os.getenv('QUIZ_SESSION_TTL', 3600))
+
+"""
+QuizSession
+    the server side state of a quiz game: the category played, the
+    question ids shuffled once when the game starts and the position of
+    the next question in that deck
+"""
+
+
+class QuizSession:
+    __slots__ = ('category', 'deck', 'cursor')
+
+    def __init__(self, category, deck, cursor=0):
+        self.category = category
+        self.deck = array('l', deck)
+        self.cursor = cursor
+
+    def to_dict(self):
+        return {
+            'category': self.category,
+            'deck': self.deck.tolist(),
+            'cursor': self.cursor,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data['category'], data['deck'], data['cursor'])
+
+
+"""
+MemorySessionStore
+    keeps quiz sessions in a dictionary of the worker process. sessions
+    expire `ttl` seconds after their last write; expired sessions are
+    evicted when read and by a sweep that runs at most once a minute
+"""
+
+
+class MemorySessionStore:
+
+    SWEEP_INTERVAL = 60
+
+    def __init__(self, ttl=QUIZ_SESSION_TTL):
+        self.ttl = ttl
+        self._sessions = {}
+        self._next_sweep = time.monotonic() + self.SWEEP_INTERVAL
+
+    def get(self, session_id):
+        entry = self._sessions.get(session_id)
+        if entry is None:
+            return None
+        if entry[0] <= time.monotonic():
+            self._sessions.pop(session_id, None)
+            return None
+        return entry[1]
+
+    def set(self, session_id, session):
+        now = time.monotonic()
+        self._sessions[session_id] = (now + self.ttl, session)
+        if now >= self._next_sweep:
+            self._next_sweep = now + self.SWEEP_INTERVAL
+            self.evict_expired(now)
+
+    def delete(self, session_id):
+        self._sessions.pop(session_id, None)
+
+    def evict_expired(self, now=None):
+        now = time.monotonic() if now is None else now
+        for session_id, entry in list(self._sessions.items()):
+            if entry[0] <= now:
+                self._sessions.pop(session_id, None)
+
+    def __len__(self):
+        return len(self._sessions)
+
+
+"""
+RedisSessionStore
+    keeps quiz sessions in a Redis compatible client (anything with
+    get, setex and delete), so that every worker sees the same games
+"""
+
+
+class RedisSessionStore:
+
+    def __init__(self, client, ttl=QUIZ_SESSION_TTL, prefix='trivia:quiz:'):
+        self.client = client
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def get(self, session_id):
+        raw = self.client.get(self.prefix + session_id)
+        if raw is None:
+            return None
+        return QuizSession.from_dict(json.loads(raw))
+
+    def set(self, session_id, session):
+        self.client.setex(self.prefix + session_id, self.ttl,
+                          json.dumps(session.to_dict()))
+
+    def delete(self, session_id):
+        self.client.delete(self.prefix + session_id)
+
+
+"""
+QuizSessions
+    starts, advances and finishes quiz sessions held in a session store
+"""
+
+
+class QuizSessions:
+
+    def __init__(self, store=None):
+        self.store = store if store is not None else MemorySessionStore()
+        self._lock = threading.Lock()
+
+    def start(self, category_id, question_ids):
+        deck = list(question_ids)
+        random.shuffle(deck)
+        session_id = secrets.token_urlsafe(12)
+        self.store.set(session_id, QuizSession(category_id, deck))
+        return session_id
+
+    def get(self, session_id):
+        return self.store.get(session_id)
+
+    def next_question_id(self, session_id):
+        # returns the id at the cursor and moves past it, None when the
+        # deck is exhausted. raises KeyError for an unknown session
+        with self._lock:
+            session = self.store.get(session_id)
+            if session is None:
+                raise KeyError(session_id)
+            if session.cursor >= len(session.deck):
+                return None
+            question_id = session.deck[session.cursor]
+            session.cursor += 1
+            self.store.set(session_id, session)
+        return question_id
+
+    def finish(self, session_id):
+        # removes the session and returns it, None if it does not exist
+        session = self.store.get(session_id)
+        self.store.delete(session_id)
+        return session
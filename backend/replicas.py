@@ -0,0 +1,93 @@
+import math
+import os
+import random
+import time
+from contextlib import contextmanager
+
+from flask import g, request, has_app_context
+
+# how long reads stay on the primary after a write, a bound on the
+# replication lag
+REPLICA_STICKY_SECONDS = float(os.getenv('REPLICA_STICKY_SECONDS', 5))
+
+STICKY_COOKIE = 'trivia_primary_until'
+
+READ_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+"""
+read_only(view)
+    marks a view that only reads from the database although its method
+    isn't GET, so that it can be served by a replica
+"""
+
+
+def read_only(view):
+    view.read_only = True
+    return view
+
+
+"""
+primary()
+    runs the statements of the block on the primary, in a request that
+    reads from a replica: the few writes of read_only views, and the
+    reads that fill the caches shared by every request of the process,
+    which would otherwise hold a replica's lagging data for clients
+    whose reads are pinned to the primary
+"""
+
+
+@contextmanager
+def primary():
+    if not has_app_context():
+        yield
+        return
+    replica = g.pop('db_replica', None)
+    try:
+        yield
+    finally:
+        if replica is not None:
+            g.db_replica = replica
+
+
+"""
+ReplicaRouter
+    picks the database each request reads from. reads go to a random
+    replica, unless the client wrote less than sticky_seconds ago, which
+    a cookie tells, or the process itself did, so that the caches it
+    fills after a write don't hold data the replicas don't have yet.
+    everything else goes to the primary
+"""
+
+
+class ReplicaRouter:
+
+    def __init__(self, binds, sticky_seconds=REPLICA_STICKY_SECONDS):
+        self.binds = list(binds)
+        self.sticky_seconds = sticky_seconds
+        self.last_write = 0.0
+
+    def is_read(self, view):
+        return (request.method in READ_METHODS or
+                getattr(view, 'read_only', False))
+
+    def route_request(self, view):
+        if not self.binds:
+            return
+        if not self.is_read(view):
+            g.db_write = True
+            return
+
+        now = time.time()
+        if (now < self.last_write + self.sticky_seconds or
+                now < request.cookies.get(STICKY_COOKIE, 0, type=float)):
+            return
+        g.db_replica = random.choice(self.binds)
+
+    def finish_request(self, response):
+        if g.get('db_write'):
+            self.last_write = time.time()
+            response.set_cookie(
+                STICKY_COOKIE,
+                '{:.3f}'.format(self.last_write + self.sticky_seconds),
+                max_age=math.ceil(self.sticky_seconds), httponly=True)
+        return response
@@ -0,0 +1,179 @@
+import functools
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from flask import request, Response
+
+from models import on_change, current_replica
+
+RESPONSE_CACHE_SIZE = int(os.getenv('RESPONSE_CACHE_SIZE', 1024))
+RESPONSE_CACHE_TTL = float(os.getenv('RESPONSE_CACHE_TTL', 30))
+
+"""
+CachedResponse
+    the body of a cached response with its strong ETag and mimetype
+"""
+
+
+class CachedResponse:
+
+    __slots__ = ('etag', 'mimetype', 'body')
+
+    def __init__(self, etag, mimetype, body):
+        self.etag = etag
+        self.mimetype = mimetype
+        self.body = body
+
+    def dumps(self):
+        return b'\n'.join((self.etag.encode(), self.mimetype.encode(),
+                           self.body))
+
+    @classmethod
+    def loads(cls, raw):
+        etag, mimetype, body = raw.split(b'\n', 2)
+        return cls(etag.decode(), mimetype.decode(), body)
+
+
+"""
+Response stores: both keep cached responses for `ttl` seconds and the data
+version, a counter bumped on every write to the questions or categories.
+MemoryResponseStore keeps at most `size` responses per worker process,
+dropping the least recently used. RedisResponseStore shares responses and
+the version between workers through a client with the get, setex and incr
+methods of redis-py; bound its memory with a maxmemory-policy of
+allkeys-lru
+"""
+
+
+class MemoryResponseStore:
+
+    def __init__(self, size=RESPONSE_CACHE_SIZE, ttl=RESPONSE_CACHE_TTL):
+        self.size = size
+        self.ttl = ttl
+        self._version = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def version(self):
+        return self._version
+
+    def bump_version(self):
+        with self._lock:
+            self._version += 1
+            # entries of older versions can't be served any more
+            self._entries.clear()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires, cached = entry
+            if expires <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return cached
+
+    def set(self, key, cached):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, cached)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class RedisResponseStore:
+
+    def __init__(self, client, ttl=RESPONSE_CACHE_TTL,
+                 prefix='trivia:response:'):
+        self.client = client
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def version(self):
+        return int(self.client.get(self.prefix + 'version') or 0)
+
+    def bump_version(self):
+        self.client.incr(self.prefix + 'version')
+
+    def get(self, key):
+        raw = self.client.get(self.prefix + key)
+        if raw is None:
+            return None
+        return CachedResponse.loads(raw)
+
+    def set(self, key, cached):
+        self.client.setex(self.prefix + key, int(self.ttl) or 1,
+                          cached.dumps())
+
+
+"""
+ResponseCache
+    serves the successful responses of GET routes from a store, keyed by
+    the data version, whether they were read from a replica, the path and
+    the query string, so a write makes every older response unreachable
+    at once. responses carry a strong ETag, the hash of their body, and
+    requests whose If-None-Match holds it are answered with an empty 304
+"""
+
+
+class ResponseCache:
+
+    def __init__(self, store=None):
+        self.store = store if store is not None else MemoryResponseStore()
+        self.hits = 0
+        self.misses = 0
+
+    def configure(self, store):
+        self.store = store
+
+    def bump_version(self, *args):
+        self.store.bump_version()
+
+    def key(self):
+        args = '&'.join('{}={}'.format(name, value) for name, value in
+                        sorted(request.args.items(multi=True)))
+        # responses read from replicas may lag behind the primary ones
+        source = 'replica' if current_replica() else 'primary'
+        return '{}:{}:{}?{}'.format(
+            self.store.version(), source, request.path, args)
+
+    def cached(self, view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            key = self.key()
+            cached = self.store.get(key)
+            if cached is None:
+                self.misses += 1
+                response = view(*args, **kwargs)
+                if response.status_code != 200 or response.is_streamed:
+                    return response
+                body = response.get_data()
+                cached = CachedResponse(
+                    hashlib.sha1(body).hexdigest(), response.mimetype, body)
+                self.store.set(key, cached)
+            else:
+                self.hits += 1
+
+            response = Response(cached.body, mimetype=cached.mimetype)
+            response.set_etag(cached.etag)
+            return response.make_conditional(request)
+        return wrapper
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+        }
+
+
+response_cache = ResponseCache()
+on_change('questions', response_cache.bump_version)
+on_change('categories', response_cache.bump_version)
@@ -0,0 +1,168 @@
+import bisect
+import csv
+import io
+import itertools
+import random
+
+from sqlalchemy import func
+
+from models import db, Question, Category, notify_change
+
+# rows sent per COPY or bulk insert
+SEED_CHUNK_SIZE = 10000
+
+DIFFICULTIES = (1, 2, 3, 4, 5)
+
+WORDS = ['river', 'planet', 'painter', 'empire', 'volcano', 'novel',
+         'league', 'symphony', 'desert', 'element', 'dynasty', 'island',
+         'film', 'record', 'mountain', 'theory', 'statue', 'ocean', 'battle',
+         'champion']
+
+"""
+WeightedChoice
+    draws items with the given weights in O(log n), from the cumulative
+    weights, where random.choices would add them up on every call
+"""
+
+
+class WeightedChoice:
+
+    def __init__(self, items, weights):
+        self.items = list(items)
+        self.cumulative = list(itertools.accumulate(weights))
+        if not self.items or self.cumulative[-1] <= 0:
+            raise ValueError('Weights must add up to more than 0')
+
+    def __call__(self, rng):
+        return self.items[bisect.bisect_right(
+            self.cumulative, rng.random() * self.cumulative[-1])]
+
+
+"""
+category_weights(count, skew)
+    Zipf-like weights of count categories: the category of rank r weighs
+    1 / r ** skew, so skew 0 spreads questions evenly and skew 1 or more
+    piles them up in the first categories
+"""
+
+
+def category_weights(count, skew):
+    return [1 / rank ** skew for rank in range(1, count + 1)]
+
+
+"""
+generate_questions(count, pick_category, pick_difficulty, first_id, id_gap,
+                   rng)
+    yields (id, question, answer, category, difficulty) rows of count
+    synthetic questions, their category and difficulty drawn by the pick
+    functions. ids start at first_id and, with an id_gap, skip
+    up to id_gap ids at random after each question, leaving the sparse
+    ids that deletions leave behind
+"""
+
+
+def generate_questions(count, pick_category, pick_difficulty, first_id,
+                       id_gap, rng):
+    question_id = first_id
+    for _ in range(count):
+        yield (question_id,
+               'Question {} about the {} and the {}?'.format(
+                   question_id, rng.choice(WORDS), rng.choice(WORDS)),
+               'Answer {}'.format(question_id),
+               pick_category(rng),
+               pick_difficulty(rng))
+        question_id += 1 + (rng.randint(0, id_gap) if id_gap else 0)
+
+
+def _copy_rows(rows):
+    # COPY is several times faster than INSERT for large loads
+    cursor = db.session.connection().connection.cursor()
+    for chunk in iter(lambda: list(itertools.islice(rows, SEED_CHUNK_SIZE)),
+                      []):
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(chunk)
+        buffer.seek(0)
+        cursor.copy_expert(
+            'COPY questions (id, question, answer, category, difficulty) '
+            'FROM STDIN WITH (FORMAT csv)', buffer)
+
+
+def _insert_rows(rows):
+    columns = ('id', 'question', 'answer', 'category', 'difficulty')
+    for chunk in iter(lambda: list(itertools.islice(rows, SEED_CHUNK_SIZE)),
+                      []):
+        db.session.execute(Question.__table__.insert(),
+                           [dict(zip(columns, row)) for row in chunk])
+
+
+def _reset_sequences():
+    # rows written with explicit ids don't advance the id sequences
+    for table in ('categories', 'questions'):
+        db.session.execute(
+            "SELECT setval(pg_get_serial_sequence('{0}', 'id'), "
+            "COALESCE((SELECT MAX(id) FROM {0}), 0) + 1, false)".format(
+                table))
+
+
+"""
+clear_database()
+    deletes every question and category
+"""
+
+
+def clear_database():
+    if db.session.bind.dialect.name == 'postgresql':
+        db.session.execute('TRUNCATE questions, categories RESTART IDENTITY')
+    else:
+        Question.query.delete()
+        Category.query.delete()
+    db.session.commit()
+    notify_change(Category.__tablename__, 'bulk')
+    notify_change(Question.__tablename__, 'bulk')
+
+
+"""
+seed_database(categories, questions, category_skew, difficulty_weights,
+              id_gap, seed, category_names)
+    adds categories new categories and questions synthetic questions
+    spread over them, with COPY on Postgres and bulk inserts elsewhere.
+    the categories are named after category_names first, then numbered.
+    returns the ids of the new categories
+"""
+
+
+def seed_database(categories, questions, category_skew=0.0,
+                  difficulty_weights=(1, 1, 1, 1, 1), id_gap=0, seed=None,
+                  category_names=()):
+    rng = random.Random(seed)
+
+    first_category = (db.session.query(func.max(Category.id)).scalar()
+                      or 0) + 1
+    names = list(category_names[:categories]) + [
+        'Category {}'.format(category_id) for category_id in
+        range(first_category + len(category_names),
+              first_category + categories)]
+    db.session.execute(Category.__table__.insert(), [
+        {'id': first_category + i, 'type': name}
+        for i, name in enumerate(names)])
+    category_ids = list(range(first_category, first_category + categories))
+
+    first_question = (db.session.query(func.max(Question.id)).scalar()
+                      or 0) + 1
+    rows = generate_questions(
+        questions,
+        WeightedChoice(category_ids,
+                       category_weights(categories, category_skew)),
+        WeightedChoice(DIFFICULTIES, difficulty_weights),
+        first_question, id_gap, rng)
+    if db.session.bind.dialect.name == 'postgresql':
+        _copy_rows(rows)
+        _reset_sequences()
+    else:
+        _insert_rows(rows)
+    db.session.commit()
+
+    # the rows were written without the model helpers
+    notify_change(Category.__tablename__, 'bulk')
+    notify_change(Question.__tablename__, 'bulk')
+    return category_ids
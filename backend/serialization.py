@@ -0,0 +1,65 @@
+import json
+
+from flask import current_app
+
+from models import Question
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+"""
+JSON responses
+
+Payloads are encoded with orjson when it is installed, several times
+faster than the json module on long question lists, and with the json
+module otherwise. Both sort the keys as jsonify does.
+"""
+
+JSON_BACKEND = 'orjson' if orjson is not None else 'json'
+
+MIMETYPE = 'application/json'
+
+
+"""
+dumps(payload)
+    encodes a payload of dicts, lists, strings, numbers, booleans and
+    None as compact JSON bytes. dict keys may be integers
+"""
+
+
+if orjson is not None:
+    def dumps(payload):
+        return orjson.dumps(
+            payload, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SORT_KEYS)
+else:
+    def dumps(payload):
+        return json.dumps(payload, separators=(',', ':'),
+                          sort_keys=True).encode()
+
+
+"""
+json_response(payload)
+    the response of the app for a payload, replacing jsonify
+"""
+
+
+def json_response(payload):
+    return current_app.response_class(dumps(payload), mimetype=MIMETYPE)
+
+
+"""
+question_rows(query) / format_questions(rows)
+    turn a query over questions into a query over the columns that
+    Question.format_row reads, returning plain rows instead of objects
+    tracked by the session, and format those rows
+"""
+
+
+def question_rows(query):
+    return query.with_entities(*Question.format_columns())
+
+
+def format_questions(rows):
+    return [Question.format_row(row) for row in rows]
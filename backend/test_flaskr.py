@@ -1,16 +1,39 @@
+import asyncio
+import csv
+import io
 import math
 import os
 import random
 import re
+import tempfile
+import threading
+import time
 from sre_parse import CATEGORIES
 from unicodedata import category
 import unittest
 import json
-from flask_sqlalchemy import SQLAlchemy
+import copy
+from flask import _app_ctx_stack
+from flask_sqlalchemy import SQLAlchemy, BaseQuery
+from sqlalchemy import create_engine, event, inspect
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.orm import scoped_session
+from asgi import create_asgi_app
 from flaskr import QUESTIONS_PER_PAGE
 from flaskr import create_app
 from flask import jsonify
-from models import setup_db, Question, Category
+from models import db, pool_stats, notify_change, Question, Category, \
+    Score, Answer
+from answer_matching import answers_match, normalize_answer
+from category_cache import category_cache
+from leaderboard import Leaderboard, leaderboard, \
+    MemoryLeaderboardStore, RedisLeaderboardStore
+from metrics import Counter
+from question_search import TrigramIndex
+from response_cache import response_cache, CachedResponse, \
+    MemoryResponseStore, RedisResponseStore
+from serialization import dumps, question_rows
+from quiz_selection import question_pools
 
 QUESTIONS_TO_INSERT = 12
 CATEGORIES_TO_INSERT = 5
@@ -20,32 +43,113 @@ PASS = os.getenv('DB_PASS', '')
 HOST = os.getenv('DB_HOST', 'localhost:5432')
 DBNAME = os.getenv('DB_NAME', 'trivia_test')
 
+# the database of the tests, the Postgres database of the DB_* settings by
+# default. any SQLAlchemy URL works, sqlite:// for an in-memory database
+TEST_DATABASE_URL = os.getenv(
+    'TEST_DATABASE_URL',
+    "postgresql://{}:{}@{}/{}".format(USER, PASS, HOST, DBNAME))
+USES_POSTGRES = TEST_DATABASE_URL.startswith('postgresql')
+
+# set by pytest-xdist in each worker when the tests are sharded with -n
+XDIST_WORKER = os.getenv('PYTEST_XDIST_WORKER')
+
+
+def create_worker_database(url):
+    # CREATES AN EMPTY POSTGRES DATABASE FOR THIS XDIST WORKER
+    # ON THE SERVER OF url AND RETURNS ITS URL
+    url = make_url(url)
+    worker_url = copy.copy(url)
+    worker_url.database = '{}_{}'.format(url.database, XDIST_WORKER)
+    server = create_engine(url, isolation_level='AUTOCOMMIT')
+    with server.connect() as connection:
+        connection.execute('DROP DATABASE IF EXISTS ' + worker_url.database)
+        connection.execute('CREATE DATABASE ' + worker_url.database)
+    server.dispose()
+    return worker_url
+
+
+def drop_worker_database(url):
+    server_url = copy.copy(url)
+    server_url.database = 'postgres'
+    server = create_engine(server_url, isolation_level='AUTOCOMMIT')
+    with server.connect() as connection:
+        connection.execute('DROP DATABASE IF EXISTS ' + url.database)
+    server.dispose()
+
+
+def enable_sqlite_savepoints(engine):
+    # PYSQLITE STARTS TRANSACTIONS ON ITS OWN, WHICH BREAKS SAVEPOINTS:
+    # LET SQLALCHEMY EMIT BEGIN INSTEAD
+    @event.listens_for(engine, 'connect')
+    def connect(dbapi_connection, connection_record):
+        dbapi_connection.isolation_level = None
+
+    @event.listens_for(engine, 'begin')
+    def begin(connection):
+        connection.execute('BEGIN')
+
 
 class TriviaTestCase(unittest.TestCase):
 
     """This class represents the trivia test case"""
 
+    @classmethod
+    def setUpClass(cls):
+        """Create the app and the schema once for all the tests."""
+        cls.database_path = TEST_DATABASE_URL
+        if XDIST_WORKER and USES_POSTGRES:
+            cls.worker_database = create_worker_database(cls.database_path)
+            cls.database_path = str(cls.worker_database)
+
+        cls.app = create_app({'SQLALCHEMY_DATABASE_URI': cls.database_path})
+        with cls.app.app_context():
+            if cls.app.config['SQLALCHEMY_DATABASE_URI'].startswith('sqlite'):
+                enable_sqlite_savepoints(db.engine)
+            db.create_all()
+            # start from empty tables
+            db.session.query(Question).delete()
+            db.session.query(Category).delete()
+            db.session.query(Score).delete()
+            db.session.query(Answer).delete()
+            db.session.commit()
+            db.session.remove()
+        cls.session = db.session
+
+    @classmethod
+    def tearDownClass(cls):
+        with cls.app.app_context():
+            db.engine.dispose()
+        if getattr(cls, 'worker_database', None) is not None:
+            drop_worker_database(cls.worker_database)
+
     def setUp(self):
         """Define test variables and initialize app."""
-        self.app = create_app()
-
         self.client = self.app.test_client
 
-        self.database_path = "postgresql://{}:{}@{}/{}".format(
-            USER,
-            PASS,
-            HOST,
-            DBNAME
+        self.db = db
 
-        )
-        setup_db(self.app, self.database_path)
-
-        # binds the app to the current context
+        # run the test in a transaction that tearDown rolls back. the
+        # sessions of the test and of its requests work in SAVEPOINTs,
+        # so that they can commit and roll back too
         with self.app.app_context():
-            self.db = SQLAlchemy()
-            self.db.init_app(self.app)
-            # create all tables
-            self.db.create_all()
+            self.connection = db.engine.connect()
+        self.transaction = self.connection.begin()
+        sessions = db.create_session({
+            'bind': self.connection, 'binds': {}, 'query_cls': BaseQuery})
+
+        @event.listens_for(sessions, 'after_transaction_end')
+        def restart_savepoint(session, transaction):
+            if transaction.nested and not transaction._parent.nested:
+                session.expire_all()
+                session.begin_nested()
+
+        def make_session():
+            session = sessions()
+            session.begin_nested()
+            return session
+
+        db.session = scoped_session(
+            make_session, scopefunc=_app_ctx_stack.__ident_func__)
 
     def clear_db(self):
         # clear the database questions and categories
@@ -59,9 +163,17 @@ class TriviaTestCase(unittest.TestCase):
 
     def tearDown(self):
         """Executed after reach test"""
-        # clear the db after every test
-        self.clear_db()
-        pass
+        # roll back everything the test wrote: the connection goes back
+        # to the pool with its transaction still open, and the pool rolls
+        # it back
+        db.session.remove()
+        db.session = self.session
+        self.connection.close()
+
+        # and forget what the caches kept of it
+        notify_change(Question.__tablename__, 'bulk')
+        notify_change(Category.__tablename__, 'bulk')
+        notify_change(Score.__tablename__, 'bulk')
 
     """
     TODO
@@ -369,7 +481,9 @@ class TriviaTestCase(unittest.TestCase):
             self.insert_categories(CATEGORIES_TO_INSERT)
             self.insert_questions(QUESTIONS_TO_INSERT)
 
-        category_type = 1
+        # an id past the last category can't exist
+        category_type = max(
+            category.id for category in Category.query.all()) + 1
         response = self.client().get(f'categories/{category_type}/questions')
         json_result = json.loads(response.data)
         self.assertEqual(json_result['success'], False)
@@ -466,6 +580,1236 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(response.status_code, 404)
         self.assertEqual(json_result['success'], False)
 
+    # Test 20
+    def test_get_questions_after_id(self):
+
+        # PAGES THROUGH ALL QUESTIONS USING THE KEYSET CURSOR
+        # AND CONFIRMS EVERY QUESTION IS RETURNED EXACTLY ONCE, IN ID ORDER
+
+        with self.app.app_context():
+            self.insert_categories(CATEGORIES_TO_INSERT)
+            self.insert_questions(QUESTIONS_TO_INSERT)
+        seen_ids = []
+        after_id = 0
+        while after_id is not None:
+            response = self.client().get(f'/questions?after_id={after_id}')
+            json_result = json.loads(response.data)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(json_result['success'], True)
+            seen_ids += [q['id'] for q in json_result['questions'] or []]
+            after_id = json_result['next_after_id']
+        all_questions_ids = [question.id for question in Question.query.all()]
+        self.assertEqual(seen_ids, sorted(all_questions_ids))
+
+    # Test 21
+    def test_get_questions_total_after_insert(self):
+
+        # CONFIRMS THAT THE CACHED TOTAL OF QUESTIONS
+        # IS REFRESHED WHEN A NEW QUESTION IS CREATED
+
+        with self.app.app_context():
+            self.insert_categories(CATEGORIES_TO_INSERT)
+            self.insert_questions(QUESTIONS_TO_INSERT)
+        response = self.client().get('/questions')
+        json_result = json.loads(response.data)
+        self.assertEqual(json_result['totalQuestions'], QUESTIONS_TO_INSERT)
+
+        category_ids = [category.id for category in Category.query.all()]
+        self.client().post('/questions', json={
+            'question': 'Who is the author of this book',
+            'answer': 'I don\'t know',
+            'category': category_ids[0],
+            'difficulty': 5
+        })
+        response = self.client().get('/questions')
+        json_result = json.loads(response.data)
+        self.assertEqual(json_result['totalQuestions'],
+                         QUESTIONS_TO_INSERT + 1)
+
+    # Test 22
+    def test_get_categories_from_cache(self):
+
+        # CONFIRMS THAT REPEATED CATEGORY LOOKUPS ARE SERVED FROM THE CACHE
+        # AND THAT CREATING A CATEGORY REFRESHES THE CACHED CATEGORIES
+
+        with self.app.app_context():
+            self.insert_categories(CATEGORIES_TO_INSERT)
+        self.client().get('/categories')
+        # the second response is built again rather than served cached
+        response_cache.bump_version()
+        stats_before = category_cache.stats()
+        response = self.client().get('/categories')
+        stats_after = category_cache.stats()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(stats_after['hits'], stats_before['hits'] + 1)
+        self.assertEqual(stats_after['misses'], stats_before['misses'])
+
+        self.client().post('/categories',
+                           json={'new_category_name': 'New Cat'})
+        response = self.client().get('/categories')
+        json_result = json.loads(response.data)
+        self.assertEqual(len(json_result['categories']),
+                         CATEGORIES_TO_INSERT + 1)
+        self.assertIn('New Cat', json_result['categories'].values())
+
+    # Test 23
+    def test_play_quiz_until_exhausted(self):
+
+        # PLAYS A CATEGORY WITH SPARSE QUESTION IDS UNTIL NO QUESTION IS LEFT
+        # AND CONFIRMS EVERY QUESTION IS SERVED EXACTLY ONCE
+
+        with self.app.app_context():
+            self.insert_categories(CATEGORIES_TO_INSERT)
+            self.insert_questions(QUESTIONS_TO_INSERT * 3)
+        category_ids = [category.id for category in Category.query.all()]
+        TEST_CATEGORY = category_ids[0]
+        all_questions = Question.query.filter(
+            Question.category == TEST_CATEGORY).all()
+        # make the ids of the category sparse
+        for question in all_questions[1::2]:
+            question.delete()
+        all_questions_ids = [question.id for question in all_questions[::2]]
+
+        previous_questions = []
+        for _ in all_questions_ids:
+            response = self.client().post('/quizzes', json={
+                'quiz_category': TEST_CATEGORY,
+                'previous_questions': previous_questions
+            })
+            json_result = json.loads(response.data)
+            self.assertEqual(response.status_code, 200)
+            self.assertNotIn(json_result['question_id'], previous_questions)
+            previous_questions.append(json_result['question_id'])
+        self.assertEqual(sorted(previous_questions), sorted(all_questions_ids))
+
+        response = self.client().post('/quizzes', json={
+            'quiz_category': TEST_CATEGORY,
+            'previous_questions': previous_questions
+        })
+        json_result = json.loads(response.data)
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(json_result['message'], 'No new question')
+
+    # Test 24
+    def test_play_quiz_session(self):
+
+        # STARTS A QUIZ SESSION, PLAYS EVERY QUESTION OF THE CATEGORY
+        # AND CONFIRMS NO QUESTION IS REPEATED BEFORE THE SESSION ENDS
+
+        with self.app.app_context():
+            self.insert_categories(CATEGORIES_TO_INSERT)
+            self.insert_questions(QUESTIONS_TO_INSERT)
+        category_ids = [category.id for category in Category.query.all()]
+        TEST_CATEGORY = category_ids[0]
+        all_questions_ids = [question.id for question in Question.query.filter(
+            Question.category == TEST_CATEGORY).all()]
+
+        response = self.client().post('/quizzes/sessions',
+                                      json={'quiz_category': TEST_CATEGORY})
+        json_result = json.loads(response.data)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json_result['total_questions'],
+                         len(all_questions_ids))
+        session_id = json_result['session_id']
+
+        played_ids = []
+        for _ in all_questions_ids:
+            response = self.client().post(
+                f'/quizzes/sessions/{session_id}/next')
+            json_result = json.loads(response.data)
+            self.assertEqual(response.status_code, 200)
+            played_ids.append(json_result['question_id'])
+        self.assertEqual(sorted(played_ids), sorted(all_questions_ids))
+
+        response = self.client().post(f'/quizzes/sessions/{session_id}/next')
+        json_result = json.loads(response.data)
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(json_result['message'], 'No new question')
+
+        response = self.client().delete(f'/quizzes/sessions/{session_id}')
+        json_result = json.loads(response.data)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json_result['questions_played'],
+                         len(all_questions_ids))
+
+    # Test 25
+    def test_404_unknown_quiz_session(self):
+
+        # ATTEMPTS TO GET A QUESTION FROM A SESSION THAT DOES NOT EXIST
+
+        response = self.client().post('/quizzes/sessions/unknown/next')
+        json_result = json.loads(response.data)
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(json_result['success'], False)
+
+    # Test 26
+    def test_search_index_matches_like_ilike(self):
+
+        # CONFIRMS THAT THE IN-MEMORY SEARCH INDEX USED WITHOUT POSTGRESQL
+        # FINDS EXACTLY THE QUESTIONS AN ILIKE SEARCH FINDS,
+        # BEST MATCH FIRST, AND FOLLOWS DELETED QUESTIONS
+
+        index = TrigramIndex()
+        index.load([
+            (1, 'Question 1'),
+            (2, 'Question 10 is a much longer question'),
+            (3, 'Another question 1'),
+            (4, 'Nothing to see'),
+        ])
+        self.assertEqual(index.search('QUESTION 1'), [1, 3, 2])
+        self.assertEqual(index.search('on'), [1, 2, 3])
+        self.assertEqual(index.search('missing'), [])
+        index.remove(1)
+        self.assertEqual(index.search('question 1'), [3, 2])
+
+    # Test 27
+    def test_search_questions_in_pages(self):
+
+        # SEARCHES WITH A SMALL PAGE SIZE AND CONFIRMS THE PAGES
+        # TOGETHER HOLD EVERY MATCHING QUESTION EXACTLY ONCE
+
+        search_term = 'Question 1'
+        with self.app.app_context():
+            self.insert_categories(CATEGORIES_TO_INSERT)
+            self.insert_questions(QUESTIONS_TO_INSERT)
+        expected_ids = [question.id for question in Question.query.filter(
+            Question.question.ilike(f'%{search_term}%')).all()]
+        found_ids = []
+        for page in range(1, 3):
+            response = self.client().post('/questions/search', json={
+                'searchTerm': search_term, 'page': page, 'limit': 2})
+            json_result = json.loads(response.data)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(json_result['total_questions'],
+                             len(expected_ids))
+            self.assertLessEqual(len(json_result['questions']), 2)
+            found_ids += [q['id'] for q in json_result['questions']]
+        self.assertEqual(sorted(found_ids), sorted(expected_ids))
+
+        response = self.client().post('/questions/search', json={
+            'searchTerm': search_term, 'page': 3, 'limit': 2})
+        self.assertEqual(response.status_code, 404)
+
+    # Test 28
+    def test_stream_search_questions(self):
+
+        # STREAMS THE SEARCH RESULTS AS JSON LINES
+        # AND CONFIRMS EVERY MATCHING QUESTION IS EMITTED
+
+        search_term = 'Question 1'
+        with self.app.app_context():
+            self.insert_categories(CATEGORIES_TO_INSERT)
+            self.insert_questions(QUESTIONS_TO_INSERT)
+        expected_ids = [question.id for question in Question.query.filter(
+            Question.question.ilike(f'%{search_term}%')).all()]
+        response = self.client().post('/questions/search', json={
+            'searchTerm': search_term, 'stream': True})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, 'application/x-ndjson')
+        streamed = [json.loads(line)
+                    for line in response.data.decode().splitlines()]
+        self.assertEqual(sorted(q['id'] for q in streamed),
+                         sorted(expected_ids))
+
+    # Test 29
+    def test_get_questions_per_category_in_pages(self):
+
+        # GETS THE QUESTIONS OF ALL CATEGORIES (CATEGORY 0) PAGE BY PAGE
+        # AND CONFIRMS THE SECOND PAGE HOLDS THE EXCESS OF 10 QUESTIONS
+
+        with self.app.app_context():
+            self.insert_categories(CATEGORIES_TO_INSERT)
+            self.insert_questions(QUESTIONS_TO_INSERT)
+        response = self.client().get('categories/0/questions?page=2')
+        json_result = json.loads(response.data)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json_result['totalQuestions'], QUESTIONS_TO_INSERT)
+        self.assertEqual(len(json_result['questions']),
+                         QUESTIONS_TO_INSERT % QUESTIONS_PER_PAGE)
+
+        response = self.client().get('categories/0/questions?page=3')
+        self.assertEqual(response.status_code, 404)
+
+    # Test 30
+    def test_count_questions_per_category(self):
+
+        # GETS ONLY THE NUMBER OF QUESTIONS IN A CATEGORY
+
+        with self.app.app_context():
+            self.insert_categories(CATEGORIES_TO_INSERT)
+            self.insert_questions(QUESTIONS_TO_INSERT)
+        category_ids = [category.id for category in Category.query.all()]
+        expected_size_of_questions = len(
+            Question.query.filter(
+                Question.category == category_ids[0]).all())
+        response = self.client().get(
+            f'categories/{category_ids[0]}/questions?count_only=1')
+        json_result = json.loads(response.data)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json_result['totalQuestions'],
+                         expected_size_of_questions)
+        self.assertNotIn('questions', json_result)
+
+    # Test 31
+    def test_create_duplicate_category(self):
+
+        # ATTEMPTS TO CREATE A CATEGORY WITH THE NAME OF AN EXISTING ONE
+        # AND CONFIRMS THAT NO CATEGORY IS CREATED
+
+        with self.app.app_context():
+            self.insert_categories(CATEGORIES_TO_INSERT)
+        response = self.client().post('/categories',
+                                      json={'new_category_name': 'Cat1'})
+        json_result = json.loads(response.data)
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(json_result['success'], False)
+        self.assertEqual(len(Category.query.all()), CATEGORIES_TO_INSERT)
+
+        response = self.client().post('/categories',
+                                      json={'new_category_name': 'Cat6'})
+        json_result = json.loads(response.data)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(Category.query.get(json_result['category_id']))
+
+    # Test 32
+    def test_create_question_in_unknown_category(self):
+
+        # ATTEMPTS TO CREATE A QUESTION IN A CATEGORY THAT DOES NOT EXIST
+
+        with self.app.app_context():
+            self.insert_categories(CATEGORIES_TO_INSERT)
+        category_ids = [category.id for category in Category.query.all()]
+        trial_q = {
+            'question': 'Who is the author of this book',
+            'answer': 'I don\'t know',
+            'category': max(category_ids) + 1,
+            'difficulty': 5
+        }
+        response = self.client().post('/questions', json=trial_q)
+        json_result = json.loads(response.data)
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(json_result['success'], False)
+        self.assertEqual(len(Question.query.all()), 0)
+
+    # Test 33
+    def test_bulk_add_questions(self):
+
+        # IMPORTS QUESTIONS AS JSON LINES, SOME OF THEM INVALID,
+        # AND CONFIRMS THE VALID ONES ARE CREATED AND THE OTHERS REPORTED
+
+        with self.app.app_context():
+            self.insert_categories(CATEGORIES_TO_INSERT)
+        category_ids = [category.id for category in Category.query.all()]
+        rows = [{
+            'question': 'Bulk question ' + str(i),
+            'answer': 'Bulk answer ' + str(i),
+            'category': category_ids[i % CATEGORIES_TO_INSERT],
+            'difficulty': i % 5
+        } for i in range(QUESTIONS_TO_INSERT)]
+        rows[3]['answer'] = ''
+        rows[7]['category'] = max(category_ids) + 1
+        body = '\n'.join(json.dumps(row) for row in rows) + '\nnot json\n'
+        response = self.client().post('/questions/bulk?batch_size=5',
+                                      data=body,
+                                      content_type='application/x-ndjson')
+        json_result = json.loads(response.data)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json_result['imported'], QUESTIONS_TO_INSERT - 2)
+        self.assertEqual(json_result['error_count'], 3)
+        self.assertEqual([error['line'] for error in json_result['errors']],
+                         [4, 8, QUESTIONS_TO_INSERT + 1])
+        self.assertEqual(len(Question.query.all()), QUESTIONS_TO_INSERT - 2)
+
+    # Test 34
+    def test_import_questions_command(self):
+
+        # IMPORTS QUESTIONS FROM A CSV FILE WITH THE FLASK COMMAND
+
+        with self.app.app_context():
+            self.insert_categories(CATEGORIES_TO_INSERT)
+        category_ids = [category.id for category in Category.query.all()]
+        with tempfile.NamedTemporaryFile('w', suffix='.csv',
+                                         delete=False) as csv_file:
+            csv_file.write('question,answer,category,difficulty\n')
+            for i in range(QUESTIONS_TO_INSERT):
+                csv_file.write('"Question {0}, from csv",Answer {0},{1},{2}\n'
+                               .format(i, category_ids[0], i % 5))
+        try:
+            result = self.app.test_cli_runner().invoke(
+                args=['import-questions', csv_file.name])
+        finally:
+            os.remove(csv_file.name)
+        self.assertEqual(result.exit_code, 0)
+        self.assertEqual(len(Question.query.filter(
+            Question.category == category_ids[0]).all()), QUESTIONS_TO_INSERT)
+
+    # Test 35
+    def test_export_questions(self):
+
+        # EXPORTS THE QUESTIONS OF A CATEGORY AS CSV
+        # AND IMPORTS THE EXPORT BACK INTO ANOTHER CATEGORY
+
+        with self.app.app_context():
+            self.insert_categories(CATEGORIES_TO_INSERT)
+            self.insert_questions(QUESTIONS_TO_INSERT)
+        category_ids = [category.id for category in Category.query.all()]
+        expected_questions = [question.format() for question in
+                              Question.query.filter(
+                                  Question.category == category_ids[0]).
+                              order_by(Question.id).all()]
+        response = self.client().get(
+            f'/questions/export?format=csv&category={category_ids[0]}')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, 'text/csv')
+        exported = list(csv.DictReader(
+            io.StringIO(response.data.decode())))
+        self.assertEqual([int(row['id']) for row in exported],
+                         [q['id'] for q in expected_questions])
+        self.assertEqual([row['question'] for row in exported],
+                         [q['question'] for q in expected_questions])
+
+        reimport = response.data.decode().replace(
+            f',{category_ids[0]},', f',{category_ids[1]},')
+        response = self.client().post('/questions/bulk', data=reimport,
+                                      content_type='text/csv')
+        json_result = json.loads(response.data)
+        self.assertEqual(json_result['imported'], len(expected_questions))
+
+        for category in ('abc', ''):
+            response = self.client().get(
+                '/questions/export?category=' + category)
+            self.assertEqual(response.status_code, 422)
+            self.assertEqual(json.loads(response.data)['message'],
+                             'Invalid category')
+
+    # Test 36
+    def test_server_timing_headers(self):
+
+        # CONFIRMS THE NUMBER OF QUERIES AND THE TIME SPENT IN THE DATABASE
+        # ARE REPORTED IN THE SERVER-TIMING HEADERS OF A RESPONSE
+
+        with self.app.app_context():
+            self.insert_categories(CATEGORIES_TO_INSERT)
+            self.insert_questions(QUESTIONS_TO_INSERT)
+        category_ids = [category.id for category in Category.query.all()]
+        response = self.client().post('/quizzes', json={
+            'quiz_category': category_ids[0], 'previous_questions': []})
+        timings = response.headers.getlist('Server-Timing')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(re.match(r'db;dur=[0-9.]+;desc="\d+ queries"',
+                                 timings[0]))
+        self.assertTrue(timings[-1].startswith('total;dur='))
+
+    # Test 37
+    def test_slow_request_is_logged(self):
+
+        # LOGS EVERY REQUEST WHEN THE SLOW REQUEST THRESHOLD IS 0
+
+        slow_request_ms = self.app.config['SLOW_REQUEST_MS']
+        self.app.config['SLOW_REQUEST_MS'] = 0
+        with self.assertLogs(self.app.logger, 'WARNING') as logs:
+            self.client().get('/questions?page=1')
+        self.app.config['SLOW_REQUEST_MS'] = slow_request_ms
+        self.assertIn('slow request GET /questions?page=1', logs.output[0])
+
+    # Test 38
+    def test_get_metrics(self):
+
+        # SERVES A FEW REQUESTS, ONE OF THEM FAILING,
+        # AND CONFIRMS THEY ARE COUNTED IN THE PROMETHEUS METRICS
+
+        before = self.get_metric_value(
+            'trivia_http_requests_total{route="/questions",method="GET",'
+            'status="200"}')
+        errors_before = self.get_metric_value(
+            'trivia_http_errors_total{status="404"}')
+        self.client().get('/questions')
+        self.client().get('/questions?page=0')
+        response = self.client().get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.content_type.startswith('text/plain'))
+        self.assertEqual(self.get_metric_value(
+            'trivia_http_requests_total{route="/questions",method="GET",'
+            'status="200"}'), before + 1)
+        self.assertEqual(self.get_metric_value(
+            'trivia_http_errors_total{status="404"}'), errors_before + 1)
+        self.assertIn('trivia_http_request_duration_seconds_bucket',
+                      response.data.decode())
+        self.assertIn('trivia_cache_requests_total{cache="category",'
+                      'result="hit"}', response.data.decode())
+
+    # Test 39
+    @unittest.skipUnless(USES_POSTGRES, 'the pool settings are for Postgres')
+    def test_connection_pool_settings(self):
+
+        # CREATES APPS WITH A SMALL POOL AND IN PGBOUNCER MODE
+        # AND CONFIRMS THE ENGINES FOLLOW THE SETTINGS
+
+        app = create_app({'SQLALCHEMY_DATABASE_URI': self.database_path,
+                          'DB_POOL_SIZE': 3, 'DB_STATEMENT_TIMEOUT': 5000})
+        with app.app_context():
+            engine = db.get_engine(app)
+            self.assertEqual(pool_stats(engine)['size'], 3)
+            self.assertEqual(engine.pool._pre_ping, True)
+            with engine.connect() as connection:
+                self.assertEqual(connection.execute(
+                    'SHOW statement_timeout').scalar(), '5s')
+            engine.dispose()
+
+        app = create_app({'SQLALCHEMY_DATABASE_URI': self.database_path,
+                          'DB_PGBOUNCER': True})
+        with app.app_context():
+            engine = db.get_engine(app)
+            self.assertEqual(pool_stats(engine), {'pool': 'NullPool'})
+            with engine.connect() as connection:
+                self.assertEqual(connection.execute('SELECT 1').scalar(), 1)
+
+    # Test 40
+    def test_init_db_command(self):
+
+        # CREATES AN APP FOR A DATABASE THAT DOESN'T EXIST YET,
+        # THEN CREATES ITS SCHEMA WITH FLASK INIT-DB
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'trivia.db')
+            app = create_app({'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + path})
+            self.assertFalse(os.path.exists(path))
+
+            result = app.test_cli_runner().invoke(args=['init-db'])
+            self.assertEqual(result.exit_code, 0, result.output)
+            with app.app_context():
+                tables = inspect(db.engine).get_table_names()
+                self.assertIn('questions', tables)
+                self.assertIn('alembic_version', tables)
+                db.engine.dispose()
+
+    # Test 41
+    def test_get_questions_conditional(self):
+
+        # GETS A PAGE OF QUESTIONS TWICE, THE SECOND TIME WITH ITS ETAG,
+        # THEN AGAIN AFTER ADDING A QUESTION WHICH CHANGES THE ETAG
+
+        with self.app.app_context():
+            self.insert_categories(CATEGORIES_TO_INSERT)
+            self.insert_questions(QUESTIONS_TO_INSERT)
+
+        response = self.client().get('/questions?page=1')
+        etag = response.headers['ETag']
+        self.assertEqual(response.status_code, 200)
+
+        response = self.client().get(
+            '/questions?page=1', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.data, b'')
+
+        with self.app.app_context():
+            self.insert_questions(1)
+        response = self.client().get(
+            '/questions?page=1', headers={'If-None-Match': etag})
+        data = json.loads(response.data)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers['ETag'], etag)
+        self.assertEqual(data['totalQuestions'], QUESTIONS_TO_INSERT + 1)
+
+    # Test 42
+    def test_response_stores(self):
+
+        # FILLS A SMALL MEMORY STORE PAST ITS SIZE, AND SERVES THE
+        # CATEGORIES FROM A STORE BACKED BY A REDIS LIKE CLIENT
+
+        store = MemoryResponseStore(size=2)
+        for key in ('a', 'b', 'c'):
+            store.set(key, CachedResponse('etag', 'text/plain', b'body'))
+        self.assertEqual(len(store), 2)
+        self.assertIsNone(store.get('a'))
+
+        class DictRedis(dict):
+
+            def setex(self, key, ttl, value):
+                self[key] = value
+
+            def incr(self, key):
+                self[key] = int(self.get(key) or 0) + 1
+
+        client = DictRedis()
+        app = create_app({'SQLALCHEMY_DATABASE_URI': self.database_path,
+                          'RESPONSE_CACHE_STORE': RedisResponseStore(client)})
+        with app.app_context():
+            self.insert_categories(CATEGORIES_TO_INSERT)
+        first = app.test_client().get('/categories')
+        second = app.test_client().get('/categories')
+        self.assertEqual(client['trivia:response:version'],
+                         CATEGORIES_TO_INSERT)
+        self.assertIn('trivia:response:5:primary:/categories?', client)
+        self.assertEqual(first.data, second.data)
+        self.assertEqual(first.headers['ETag'], second.headers['ETag'])
+        response_cache.configure(MemoryResponseStore())
+
+    # Test 43
+    def test_question_rows_format(self):
+
+        # CONFIRMS THAT A QUESTION ROW IS FORMATTED LIKE ITS QUESTION
+        # AND THAT PAYLOADS WITH CATEGORY IDS AS KEYS ARE ENCODED
+
+        with self.app.app_context():
+            self.insert_categories(CATEGORIES_TO_INSERT)
+            self.insert_questions(1)
+            question = Question.query.one()
+            row = question_rows(Question.query).one()
+            self.assertNotIsInstance(row, Question)
+            self.assertEqual(Question.format_row(row), question.format())
+
+        self.assertEqual(json.loads(dumps({3: 'Art', 1: None})),
+                         {'1': None, '3': 'Art'})
+
+    # Test 44
+    def test_column_read_helpers(self):
+
+        # CONFIRMS THE COLUMN ONLY HELPERS RETURN THE SAME IDS AND TYPES
+        # AS THE QUESTIONS AND CATEGORIES THEMSELVES
+
+        with self.app.app_context():
+            self.insert_categories(CATEGORIES_TO_INSERT)
+            self.insert_questions(QUESTIONS_TO_INSERT)
+            categories = Category.query.all()
+            self.assertEqual(
+                Category.id_type_map(),
+                {category.id: category.type for category in categories})
+
+            category_id = categories[0].id
+            self.assertEqual(
+                sorted(Question.ids_in_category(category_id)),
+                sorted(question.id for question in Question.query.filter(
+                    Question.category == category_id)))
+            self.assertEqual(len(Question.ids_in_category(0)),
+                             QUESTIONS_TO_INSERT)
+
+    # Test 45
+    def test_asgi_entry_point(self):
+
+        # SERVES A GET AND A POST REQUEST THROUGH THE ASGI ADAPTER
+        # AND CONFIRMS THEY GET THE RESPONSES OF THE WSGI APP
+
+        app = create_asgi_app(
+            {'SQLALCHEMY_DATABASE_URI': self.database_path})
+        with self.app.app_context():
+            self.insert_categories(CATEGORIES_TO_INSERT)
+            self.insert_questions(QUESTIONS_TO_INSERT)
+
+        status, headers, body = asyncio.run(
+            self.asgi_request(app, 'GET', '/categories'))
+        self.assertEqual(status, 200)
+        self.assertIn((b'content-type', b'application/json'), headers)
+        self.assertEqual(len(json.loads(body)['categories']),
+                         CATEGORIES_TO_INSERT)
+
+        status, headers, body = asyncio.run(self.asgi_request(
+            app, 'POST', '/quizzes',
+            {'quiz_category': 0, 'previous_questions': []}))
+        self.assertEqual(status, 200)
+        self.assertTrue(json.loads(body)['success'])
+
+        # a chunked upload comes without a content length
+        for chunked in (False, True):
+            row = {'question': 'Uploaded question ' + str(chunked),
+                   'answer': 'Uploaded answer',
+                   'category': Category.query.first().id, 'difficulty': 1}
+            status, headers, body = asyncio.run(self.asgi_request(
+                app, 'POST', '/questions/bulk', row, chunked))
+            self.assertEqual(status, 200)
+            self.assertEqual(json.loads(body)['imported'], 1)
+        app.executor.shutdown()
+
+    async def asgi_request(self, app, method, path, body=None,
+                           chunked=False):
+        # SENDS A REQUEST TO AN ASGI APP AND RETURNS ITS RESPONSE,
+        # THE BODY IN TWO CHUNKS WHEN CHUNKED
+        headers = []
+        data = b''
+        if body is not None:
+            data = json.dumps(body).encode()
+            headers = [(b'content-type', b'application/json')]
+            if chunked:
+                headers.append((b'transfer-encoding', b'chunked'))
+            else:
+                headers.append((b'content-length', str(len(data)).encode()))
+        scope = {'type': 'http', 'method': method, 'path': path,
+                 'query_string': b'', 'headers': headers}
+        messages = []
+        chunks = ([data[:len(data) // 2], data[len(data) // 2:]]
+                  if chunked else [data])
+
+        async def receive():
+            chunk = chunks.pop(0)
+            return {'type': 'http.request', 'body': chunk,
+                    'more_body': bool(chunks)}
+
+        async def send(message):
+            messages.append(message)
+
+        await app(scope, receive, send)
+        return (messages[0]['status'], messages[0]['headers'],
+                b''.join(message.get('body', b'')
+                         for message in messages[1:]))
+
+    # Test 46
+    def test_reads_from_replica(self):
+
+        # READS FROM AN EMPTY SQLITE REPLICA, THEN WRITES A CATEGORY
+        # AND CONFIRMS THE NEXT READS OF THE CLIENT GO TO THE PRIMARY,
+        # WHILE THE SHARED CACHES ARE ONLY EVER FILLED FROM THE PRIMARY
+
+        with self.app.app_context():
+            self.insert_categories(CATEGORIES_TO_INSERT)
+            self.insert_questions(QUESTIONS_TO_INSERT)
+
+        with tempfile.TemporaryDirectory() as directory:
+            replica_path = 'sqlite:///' + os.path.join(directory, 'replica.db')
+            app = create_app({'SQLALCHEMY_DATABASE_URI': self.database_path,
+                              'DB_REPLICA_URIS': [replica_path]})
+            with app.app_context():
+                # the replica has the schema but none of the rows
+                db.metadata.create_all(db.get_engine(app, 'replica_0'))
+            category_cache.invalidate()
+            client = app.test_client()
+
+            # the question ids of a session are read from the replica
+            response = client.post('/quizzes/sessions',
+                                   json={'quiz_category': 0})
+            self.assertEqual(response.status_code, 404)
+            # the categories and the question pools from the primary,
+            # while the questions drawn are still read from the replica
+            response = client.get('/categories')
+            self.assertEqual(len(json.loads(response.data)['categories']),
+                             CATEGORIES_TO_INSERT)
+            response = client.post('/quizzes', json={
+                'quiz_category': 0, 'previous_questions': []})
+            self.assertEqual(json.loads(response.data)['message'],
+                             'No new question')
+            self.assertEqual(question_pools.count(0), QUESTIONS_TO_INSERT)
+
+            response = client.post('/categories',
+                                   json={'new_category_name': 'New Cat'})
+            self.assertIn('trivia_primary_until=',
+                          response.headers['Set-Cookie'])
+            response = client.get('/categories')
+            self.assertEqual(len(json.loads(response.data)['categories']),
+                             CATEGORIES_TO_INSERT + 1)
+            response = client.post('/quizzes/sessions',
+                                   json={'quiz_category': 0})
+            self.assertEqual(response.status_code, 200)
+
+            with app.app_context():
+                db.get_engine(app, 'replica_0').dispose()
+        category_cache.invalidate()
+
+    # Test 47
+    def test_seed_command(self):
+
+        # SEEDS SKEWED QUESTIONS WITH SPARSE IDS AND CONFIRMS THE
+        # NUMBERS AND THAT NEW QUESTIONS CAN STILL BE ADDED
+
+        result = self.app.test_cli_runner().invoke(args=[
+            'seed', '--categories', '3', '--questions', '300',
+            '--category-skew', '2', '--difficulty-weights', '0,0,1,0,0',
+            '--id-gap', '4', '--seed', '1'])
+        self.assertEqual(result.exit_code, 0, result.output)
+
+        with self.app.app_context():
+            self.assertEqual(Category.query.count(), 3)
+            self.assertEqual(Question.query.count(), 300)
+            self.assertEqual(
+                {question.difficulty for question in Question.query}, {3})
+            counts = [Question.query.filter(
+                Question.category == category.id).count()
+                for category in Category.query.order_by(Category.id)]
+            self.assertEqual(counts, sorted(counts, reverse=True))
+            self.assertGreater(
+                db.session.query(db.func.max(Question.id)).scalar(), 300)
+
+        response = self.client().post('/questions', json={
+            'question': 'New question', 'answer': 'New answer',
+            'category': Category.query.first().id, 'difficulty': 1})
+        self.assertEqual(response.status_code, 200)
+
+        # bad input is reported as a usage error, before any write
+        for args in (['--categories', '0'], ['--questions', '-1'],
+                     ['--id-gap', '-1'],
+                     ['--difficulty-weights', '0,0,0,0,0'],
+                     ['--difficulty-weights', '1,-1,1,1,1']):
+            result = self.app.test_cli_runner().invoke(args=['seed'] + args)
+            self.assertEqual(result.exit_code, 2, result.output)
+        with self.app.app_context():
+            self.assertEqual(Question.query.count(), 301)
+
+    # Test 48
+    def test_quiz_difficulty(self):
+
+        # PLAYS EVERY QUESTION OF A DIFFICULTY RANGE, THEN CONFIRMS THE
+        # POOLS FOLLOW INSERTED AND DELETED QUESTIONS AND THAT A BAD
+        # DIFFICULTY IS REJECTED
+
+        with self.app.app_context():
+            self.insert_categories(CATEGORIES_TO_INSERT)
+            self.insert_questions(QUESTIONS_TO_INSERT)
+            expected = {question.id for question in Question.query.filter(
+                Question.difficulty.between(1, 2))}
+
+        played = []
+        while True:
+            response = self.client().post('/quizzes', json={
+                'quiz_category': 0, 'previous_questions': played,
+                'difficulty_range': [1, 2]})
+            if response.status_code != 200:
+                break
+            played.append(json.loads(response.data)['question_id'])
+        self.assertEqual(json.loads(response.data)['message'],
+                         'No new question')
+        self.assertEqual(len(played), len(expected))
+        self.assertEqual(set(played), expected)
+
+        with self.app.app_context():
+            category_id = Category.query.first().id
+            question = Question(question='New question', answer='New answer',
+                                category=category_id, difficulty=2)
+            question.insert()
+            new_id = question.id
+
+        response = self.client().post('/quizzes', json={
+            'quiz_category': category_id, 'previous_questions': [],
+            'difficulty': 2})
+        self.assertEqual(json.loads(response.data)['question_id'], new_id)
+
+        with self.app.app_context():
+            Question.query.get(new_id).delete()
+        response = self.client().post('/quizzes', json={
+            'quiz_category': category_id, 'previous_questions': [],
+            'difficulty': 2})
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(json.loads(response.data)['message'],
+                         'No question or category')
+
+        response = self.client().post('/quizzes', json={
+            'quiz_category': 0, 'previous_questions': [],
+            'difficulty': 1, 'difficulty_range': [1, 2]})
+        self.assertEqual(response.status_code, 422)
+        response = self.client().post('/quizzes', json={
+            'quiz_category': 0, 'previous_questions': [],
+            'difficulty_range': [3, 1]})
+        self.assertEqual(response.status_code, 422)
+        response = self.client().post('/quizzes', json={
+            'quiz_category': 0, 'previous_questions': 5})
+        self.assertEqual(response.status_code, 422)
+
+    # Test 49
+    def test_quiz_round(self):
+
+        # FETCHES ROUNDS OF DISTINCT QUESTIONS IN ONE QUERY EACH UNTIL THE
+        # QUESTIONS RUN OUT, THEN CONFIRMS INVALID ROUNDS ARE REJECTED
+
+        with self.app.app_context():
+            self.insert_categories(CATEGORIES_TO_INSERT)
+            self.insert_questions(QUESTIONS_TO_INSERT)
+
+        statements = []
+
+        def count_statement(*args):
+            statements.append(args[2])
+
+        played = []
+        with self.app.app_context():
+            engine = db.get_engine()
+            event.listen(engine, 'before_cursor_execute', count_statement)
+            try:
+                response = self.client().post('/quizzes/round', json={
+                    'quiz_category': 0, 'previous_questions': [],
+                    'count': 5})
+            finally:
+                event.remove(engine, 'before_cursor_execute', count_statement)
+        data = json.loads(response.data)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(data['questions']), 5)
+        self.assertEqual([question['id'] for question in data['questions']],
+                         data['question_ids'])
+        # one query reads the pools, the other the questions of the round
+        self.assertEqual(len([statement for statement in statements
+                              if 'FROM questions' in statement]), 2)
+        played.extend(data['question_ids'])
+
+        response = self.client().post('/quizzes/round', json={
+            'quiz_category': 0, 'previous_questions': played, 'count': 50})
+        data = json.loads(response.data)
+        played.extend(data['question_ids'])
+        self.assertEqual(len(set(played)), QUESTIONS_TO_INSERT)
+
+        response = self.client().post('/quizzes/round', json={
+            'quiz_category': 0, 'previous_questions': played})
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(json.loads(response.data)['message'],
+                         'No new question')
+
+        response = self.client().post('/quizzes/round', json={
+            'quiz_category': 0, 'previous_questions': [], 'count': 0})
+        self.assertEqual(response.status_code, 422)
+        for previous_questions in (5, 'abc', [{'id': 1}]):
+            response = self.client().post('/quizzes/round', json={
+                'quiz_category': 0, 'previous_questions': previous_questions})
+            self.assertEqual(response.status_code, 422)
+        response = self.client().post('/quizzes/round', json={
+            'quiz_category': 1000, 'previous_questions': []})
+        self.assertEqual(response.status_code, 404)
+
+    # Test 50
+    def test_answer_matching(self):
+
+        # CONFIRMS ANSWERS MATCH WHATEVER THEIR CASE, ACCENTS, PUNCTUATION
+        # AND LEADING ARTICLE, WITH A FEW TYPOS BUT NOT OTHER NUMBERS
+
+        self.assertEqual(normalize_answer('  The Beatles!! '), 'beatles')
+        self.assertEqual(normalize_answer('Pelé'), 'pele')
+        self.assertTrue(answers_match('muhammad ali', 'Muhammad Ali'))
+        self.assertTrue(answers_match('Mohammad Ali', 'Muhammad Ali'))
+        self.assertTrue(answers_match('Edward Sissorhands',
+                                      'Edward Scissorhands'))
+        self.assertTrue(answers_match('the Scarab', 'Scarab'))
+        self.assertFalse(answers_match('Apollo', 'Apollo 13'))
+        self.assertFalse(answers_match('1991', '1990'))
+        self.assertFalse(answers_match('Brazil', 'Uruguay'))
+        self.assertFalse(answers_match('', 'Uruguay'))
+        self.assertFalse(answers_match('Tom', 'Tim'))
+
+    # Test 51
+    def test_answer_and_leaderboard(self):
+
+        # SCORES THE ANSWERS OF TWO PLAYERS, CONFIRMS THEIR RANKS AND THAT
+        # THE POINTS REACH THE DATABASE IN BATCHES THAT A NEW LEADERBOARD
+        # IS FILLED FROM
+
+        with self.app.app_context():
+            self.insert_categories(CATEGORIES_TO_INSERT)
+            self.insert_questions(QUESTIONS_TO_INSERT)
+            question_ids = [question.id for question in
+                            Question.query.order_by(Question.id)]
+        flush_seconds, flush_size = (leaderboard.flush_seconds,
+                                     leaderboard.flush_size)
+        leaderboard.flush_seconds, leaderboard.flush_size = 3600, 2
+        self.addCleanup(setattr, leaderboard, 'flush_seconds', flush_seconds)
+        self.addCleanup(setattr, leaderboard, 'flush_size', flush_size)
+
+        def answer(player, question_id, text):
+            return self.client().post('/quizzes/answer', json={
+                'player': player, 'question_id': question_id,
+                'answer': text})
+
+        data = json.loads(answer('alice', question_ids[0], 'ANSWER 1!').data)
+        self.assertTrue(data['correct'])
+        self.assertEqual((data['score'], data['rank']), (1, 1))
+        data = json.loads(answer('alice', question_ids[1], 'Answer3').data)
+        self.assertFalse(data['correct'])
+        self.assertEqual(data['answer'], 'Answer2')
+        self.assertEqual(data['score'], 1)
+
+        # the second player with points fills the batch
+        answer('bob', question_ids[1], 'answer2')
+        data = json.loads(answer('bob', question_ids[2], 'answer3').data)
+        self.assertEqual((data['score'], data['rank']), (2, 1))
+        with self.app.app_context():
+            self.assertEqual(dict(db.session.query(Score.player, Score.score)),
+                             {'alice': 1, 'bob': 1})
+
+        data = json.loads(self.client().get('/leaderboard?limit=1').data)
+        self.assertEqual(data['leaderboard'],
+                         [{'rank': 1, 'player': 'bob', 'score': 2}])
+        self.assertEqual(data['total_players'], 2)
+        data = json.loads(self.client().get('/leaderboard/alice').data)
+        self.assertEqual((data['rank'], data['score']), (2, 1))
+        response = self.client().get('/leaderboard/carol')
+        self.assertEqual(response.status_code, 404)
+
+        flushes = self.get_metric_value('trivia_leaderboard_flushes_total')
+        with self.app.app_context():
+            leaderboard.flush()
+            self.assertEqual(Score.query.get('bob').score, 2)
+        self.assertEqual(self.get_metric_value(
+            'trivia_leaderboard_flushes_total'), flushes + 1)
+        leaderboard.configure(MemoryLeaderboardStore())
+        data = json.loads(self.client().get('/leaderboard/bob').data)
+        self.assertEqual((data['rank'], data['score']), (1, 2))
+
+        response = answer('', question_ids[0], 'answer1')
+        self.assertEqual(response.status_code, 422)
+        response = answer('alice', max(question_ids) + 1, 'answer1')
+        self.assertEqual(response.status_code, 404)
+
+    # Test 52
+    def test_redis_leaderboard_store(self):
+
+        # RANKS PLAYERS IN A STORE BACKED BY A CLIENT WITH THE SORTED SET
+        # COMMANDS OF REDIS, FILLED FROM THE DATABASE ONLY ONCE
+
+        class SortedSetRedis(dict):
+
+            def zincrby(self, key, amount, member):
+                members = self.setdefault(key, {})
+                members[member] = members.get(member, 0) + amount
+                return float(members[member])
+
+            def zscore(self, key, member):
+                return self.get(key, {}).get(member)
+
+            def ranking(self, key):
+                return sorted(self.get(key, {}).items(),
+                              key=lambda item: (item[1], item[0]),
+                              reverse=True)
+
+            def zrevrank(self, key, member):
+                members = [member for member, _ in self.ranking(key)]
+                return members.index(member) if member in members else None
+
+            def zrevrange(self, key, start, end, withscores=False):
+                return [(member.encode(), float(score)) for member, score
+                        in self.ranking(key)[start:end + 1]]
+
+            def zadd(self, key, mapping):
+                self.setdefault(key, {}).update(mapping)
+
+            def zcard(self, key):
+                return len(self.get(key, {}))
+
+            def setnx(self, key, value):
+                return self.setdefault(key, value) is value
+
+            def delete(self, *keys):
+                for key in keys:
+                    self.pop(key, None)
+
+        with self.app.app_context():
+            db.session.add(Score(player='carol', score=5))
+            db.session.commit()
+
+        client = SortedSetRedis()
+        self.addCleanup(leaderboard.configure, MemoryLeaderboardStore())
+        for _ in range(2):
+            # a second worker sharing the store doesn't load it again
+            leaderboard.configure(RedisLeaderboardStore(client))
+            with self.app.app_context():
+                self.assertTrue(leaderboard.record('dave', _ + 1, 3))
+                self.assertFalse(leaderboard.record('dave', 1, 3))
+        self.assertEqual(self.client().get('/leaderboard/dave').get_json()[
+            'score'], 6)
+        data = json.loads(self.client().get('/leaderboard').data)
+        self.assertEqual([(entry['player'], entry['score'])
+                          for entry in data['leaderboard']],
+                         [('dave', 6), ('carol', 5)])
+
+    # Test 53
+    def test_answer_scored_once(self):
+
+        # SUBMITS THE SAME CORRECT ANSWER SEVERAL TIMES, BEFORE AND AFTER
+        # THE LEADERBOARD IS READ AGAIN FROM THE DATABASE, AND CONFIRMS
+        # IT ONLY SCORES ONCE
+
+        with self.app.app_context():
+            self.insert_categories(CATEGORIES_TO_INSERT)
+            self.insert_questions(QUESTIONS_TO_INSERT)
+            question_id = Question.query.order_by(Question.id).first().id
+
+        def answer():
+            return json.loads(self.client().post('/quizzes/answer', json={
+                'player': 'eve', 'question_id': question_id,
+                'answer': 'Answer1'}).data)
+
+        data = answer()
+        self.assertTrue(data['scored'])
+        for _ in range(4):
+            data = answer()
+            self.assertTrue(data['correct'])
+            self.assertFalse(data['scored'])
+        self.assertEqual((data['score'], data['rank']), (1, 1))
+
+        with self.app.app_context():
+            leaderboard.flush()
+            self.assertEqual(Answer.query.count(), 1)
+        leaderboard.configure(MemoryLeaderboardStore())
+        data = answer()
+        self.assertFalse(data['scored'])
+        self.assertEqual(data['score'], 1)
+
+    # Test 54
+    def test_leaderboard_flush_timer(self):
+
+        # SCORES ONE ANSWER AND CONFIRMS ITS POINT IS WRITTEN TO THE
+        # DATABASE WITHOUT ANY FURTHER ANSWER
+
+        with self.app.app_context():
+            self.insert_categories(CATEGORIES_TO_INSERT)
+            self.insert_questions(QUESTIONS_TO_INSERT)
+            question_id = Question.query.order_by(Question.id).first().id
+            leaderboard.flush()
+        flush_seconds = leaderboard.flush_seconds
+        leaderboard.flush_seconds = 0.05
+        self.addCleanup(setattr, leaderboard, 'flush_seconds', flush_seconds)
+
+        flushes = leaderboard.stats()['flushes']
+        self.client().post('/quizzes/answer', json={
+            'player': 'frank', 'question_id': question_id,
+            'answer': 'Answer1'})
+        deadline = time.monotonic() + 5
+        while (leaderboard.stats()['flushes'] == flushes and
+               time.monotonic() < deadline):
+            time.sleep(0.01)
+
+        with self.app.app_context():
+            self.assertEqual(Score.query.get('frank').score, 1)
+
+    # Test 55
+    def test_category_created_by_another_worker(self):
+
+        # CREATES A CATEGORY BEHIND THE BACK OF THE CATEGORY CACHE, AS
+        # ANOTHER WORKER WOULD, AND CONFIRMS IT CAN BE USED AT ONCE, WHILE
+        # UNKNOWN CATEGORIES RELOAD THE CACHE AT MOST ONCE A SECOND
+
+        with self.app.app_context():
+            self.insert_categories(CATEGORIES_TO_INSERT)
+            self.insert_questions(QUESTIONS_TO_INSERT)
+            category_id = db.session.query(
+                db.func.max(Category.id)).scalar() + 1
+        self.client().get('/categories')
+
+        with self.app.app_context():
+            db.session.execute(Category.__table__.insert(),
+                               {'id': category_id, 'type': 'Other worker'})
+            db.session.commit()
+
+        reload_seconds = category_cache.miss_reload_seconds
+        self.addCleanup(setattr, category_cache, 'miss_reload_seconds',
+                        reload_seconds)
+        category_cache.miss_reload_seconds = 3600
+        response = self.client().post('/questions', json={
+            'question': 'New question', 'answer': 'New answer',
+            'category': category_id, 'difficulty': 1})
+        self.assertEqual(response.status_code, 404)
+
+        category_cache.miss_reload_seconds = 0
+        response = self.client().post('/questions', json={
+            'question': 'New question', 'answer': 'New answer',
+            'category': category_id, 'difficulty': 1})
+        self.assertEqual(response.status_code, 200)
+        response = self.client().post('/quizzes', json={
+            'quiz_category': category_id, 'previous_questions': []})
+        self.assertEqual(response.status_code, 200)
+
+    # Test 56
+    def test_metrics_short_lived_threads(self):
+
+        # COUNTS FROM MANY SHORT-LIVED THREADS, AS A THREAD PER REQUEST
+        # SERVER WOULD, AND CONFIRMS THE SHARDS DON'T PILE UP
+
+        counter = Counter('test_total', 'Test counter.')
+        for _ in range(500):
+            thread = threading.Thread(target=counter.inc)
+            thread.start()
+            thread.join()
+        self.assertEqual(counter.values(), {(): 500})
+        self.assertLess(len(counter._shards.all()), 50)
+
+    # Test 57
+    def test_search_invalid_page(self):
+
+        # CONFIRMS A PAGE OR LIMIT THAT IS NOT A NUMBER IS REJECTED,
+        # AS IS A SEARCH TERM THAT IS NOT A STRING
+
+        with self.app.app_context():
+            self.insert_categories(CATEGORIES_TO_INSERT)
+            self.insert_questions(QUESTIONS_TO_INSERT)
+        for params in ({'page': 'x'}, {'limit': None}, {'limit': [1]}):
+            response = self.client().post('/questions/search', json=dict(
+                params, searchTerm='Question'))
+            self.assertEqual(response.status_code, 422)
+            self.assertEqual(json.loads(response.data)['message'],
+                             'Invalid page number or limit')
+
+        # and a search term that is not a string
+        for params in ({'searchTerm': None}, {'searchTerm': 12}, {}):
+            response = self.client().post('/questions/search', json=params)
+            self.assertEqual(response.status_code, 422)
+            self.assertEqual(json.loads(response.data)['message'],
+                             'Invalid search term')
+
+    # Test 58
+    def test_answer_after_wrong_answer(self):
+
+        # ANSWERS A QUESTION WRONGLY, THEN WITH THE ANSWER SENT BACK, AND
+        # CONFIRMS ONLY THE FIRST ANSWER COUNTS
+
+        with self.app.app_context():
+            self.insert_categories(CATEGORIES_TO_INSERT)
+            self.insert_questions(QUESTIONS_TO_INSERT)
+            question_id = Question.query.order_by(Question.id).first().id
+
+        def answer(text):
+            return json.loads(self.client().post('/quizzes/answer', json={
+                'player': 'grace', 'question_id': question_id,
+                'answer': text}).data)
+
+        data = answer('zzz')
+        self.assertFalse(data['correct'])
+        self.assertFalse(data['scored'])
+        data = answer(data['answer'])
+        self.assertTrue(data['correct'])
+        self.assertFalse(data['scored'])
+        self.assertEqual((data['score'], data['rank']), (0, None))
+        response = self.client().get('/leaderboard/grace')
+        self.assertEqual(response.status_code, 404)
+
+        with self.app.app_context():
+            leaderboard.flush()
+            self.assertEqual(Answer.query.count(), 1)
+            self.assertIsNone(Score.query.get('grace'))
+
+    # Test 59
+    def test_answer_recorded_by_two_workers(self):
+
+        # RECORDS THE SAME FIRST ANSWER IN THE LEADERBOARDS OF TWO WORKERS,
+        # WITH STORES OF THEIR OWN AND WITH A SHARED STORE, AND CONFIRMS
+        # THE DATABASE AND THE SHARED STORE COUNT IT ONCE
+
+        with self.app.app_context():
+            self.insert_categories(CATEGORIES_TO_INSERT)
+            self.insert_questions(QUESTIONS_TO_INSERT)
+            question_ids = [question.id for question in
+                            Question.query.order_by(Question.id)]
+
+            workers = [Leaderboard(MemoryLeaderboardStore())
+                       for _ in range(2)]
+            for worker in workers:
+                self.assertTrue(worker.record('bob', question_ids[0], 1))
+            for worker in workers:
+                worker.flush()
+            self.assertEqual(Score.query.get('bob').score, 1)
+            self.assertEqual(Answer.query.filter(
+                Answer.player == 'bob').count(), 1)
+
+            store = MemoryLeaderboardStore()
+            workers = [Leaderboard(store) for _ in range(2)]
+            for worker in workers:
+                worker.players()
+            for worker in workers:
+                self.assertTrue(worker.record('bob', question_ids[1], 1))
+                self.assertFalse(worker.record('bob', question_ids[0], 1))
+            self.assertEqual(store.score('bob'), 3)
+            for worker in workers:
+                worker.flush()
+            self.assertEqual(store.score('bob'), 2)
+            self.assertEqual(Score.query.get('bob').score, 2)
+
+    def get_metric_value(self, sample):
+        # RETURNS THE VALUE OF A SAMPLE OF THE METRICS, 0 IF NOT REPORTED
+        for line in self.client().get('/metrics').data.decode().splitlines():
+            if line.startswith(sample + ' '):
+                return float(line.split(' ')[-1])
+        return 0
+
     def insert_questions(self, x):
         # INSERTS TEST QUESTIONS
         for i in range(0, x):
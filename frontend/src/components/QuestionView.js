@@ -14,6 +14,7 @@ class QuestionView extends Component {
       totalQuestions: 0,
       categories: {},
       currentCategory: 0,
+      currentCategoryId: null,
       searchQuery:''
     };
   }
@@ -88,6 +89,11 @@ class QuestionView extends Component {
 
   
   selectPage(num) {
+    // the pages of a category are pages of its own questions
+    if (this.state.viewMode === 'CATEGORY') {
+      this.getByCategory(this.state.currentCategoryId, num);
+      return;
+    }
     this.setState({ page: num }, () => this.getQuestions());
   }
 
@@ -110,16 +116,18 @@ class QuestionView extends Component {
     return pageNumbers;
   }
 
-  getByCategory = (id) => {
+  getByCategory = (id, page = 1) => {
     $.ajax({
-      url: `/categories/${id}/questions`, //TODO: update request URL
+      url: `/categories/${id}/questions?page=${page}`, //TODO: update request URL
       type: 'GET',
       success: (result) => {
         this.setState({
           viewMode:'CATEGORY',
+          page: page,
           questions: result.questions,
           totalQuestions: result.totalQuestions,
           currentCategory: this.state.categories[result.currentCategory],
+          currentCategoryId: id,
         });
         return;
       },
@@ -168,7 +176,7 @@ class QuestionView extends Component {
           success: (result) => {
             
               if (this.state.viewMode == 'GENERAL') this.getQuestions();
-              else if (this.state.viewMode == 'CATEGORY') this.getByCategory(cat_id)
+              else if (this.state.viewMode == 'CATEGORY') this.getByCategory(cat_id, this.state.page)
               else if (this.state.viewMode == 'SEARCH') this.submitSearch(this.state.searchQuery)
             
             //alert(this.state.currentCategory)
@@ -217,7 +225,7 @@ class QuestionView extends Component {
         <div className='categories-list'>
           <h2
             onClick={() => {
-              this.getQuestions();
+              this.setState({ page: 1 }, () => this.getQuestions());
             }}
           >
             Categories